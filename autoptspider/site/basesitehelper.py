@@ -1,9 +1,29 @@
+import asyncio
+import time
 from abc import ABCMeta, abstractmethod
-from typing import List, Optional
+from typing import List, Optional, AsyncIterator, Dict
+
 from moviebotapi.site import CateLevel1, TorrentList, SiteUserinfo, TorrentDetail
 
 from autoptspider.utils.stringutils import StringUtils
 
+# 合并搜索时无法分配给任何关键字的结果，放在这个键下
+BATCH_UNMATCHED = ''
+
+
+class DetailResult:
+    url: str
+    detail: Optional[TorrentDetail]
+    err_msg: Optional[str]
+    runtime: float
+
+    def __init__(self, url: str, detail: Optional[TorrentDetail] = None, err_msg: Optional[str] = None,
+                 runtime: float = 0):
+        self.url = url
+        self.detail = detail
+        self.err_msg = err_msg
+        self.runtime = runtime
+
 
 class BaseSiteHelper(metaclass=ABCMeta):
     category_mappings = None
@@ -12,10 +32,20 @@ class BaseSiteHelper(metaclass=ABCMeta):
     proxies = None
     user_agent = None
     cookie_str = None
+    # 支持多个关键字合并搜索时为合并搜索的配置
+    batch_search = None
 
     def get_cookie_str(self):
         return self.cookie_str
 
+    def can_batch_keyword(self, keyword: str) -> bool:
+        """
+        关键字能否与其他关键字合并为一次OR搜索
+        :param keyword:
+        :return:
+        """
+        return False
+
     def get_id(self):
         return self.site_config.get('id')
 
@@ -49,15 +79,6 @@ class BaseSiteHelper(metaclass=ABCMeta):
                 payload[p.get('name')] = p.get('value')
         return payload
 
-    def _get_response_text(self, r):
-        if not r:
-            return
-        c = r.content
-        if not c:
-            return
-        s = str(r.content, self.get_encoding())
-        return StringUtils.trim_emoji(s)
-
     @staticmethod
     def _init_category_mappings(category_mappings):
         cates = []
@@ -115,8 +136,22 @@ class BaseSiteHelper(metaclass=ABCMeta):
             return ids
         return new_ids
 
+    async def aclose(self):
+        """
+        释放站点持有的网络连接等资源
+        :return:
+        """
+        pass
+
+    def reset_last_page(self):
+        """
+        清除上次搜索留下的页面内容，之后获取用户信息时重新请求
+        :return:
+        """
+        pass
+
     @abstractmethod
-    async def list(self, timeout=None, cate_level1_list=None) -> TorrentList:
+    async def list(self, timeout=None, cate_level1_list=None, fields: Optional[List[str]] = None) -> TorrentList:
         pass
 
     @abstractmethod
@@ -126,13 +161,70 @@ class BaseSiteHelper(metaclass=ABCMeta):
     @abstractmethod
     async def search(self, keyword=None, imdb_id=None, cate_level1_list: list = None, free: bool = False,
                      page: int = None,
-                     timeout=None) -> TorrentList:
+                     timeout=None, fields: Optional[List[str]] = None) -> TorrentList:
         pass
 
+    async def search_batch(self, keywords: List[str], cate_level1_list: list = None, free: bool = False,
+                           page: int = None, timeout=None,
+                           fields: Optional[List[str]] = None) -> Dict[str, TorrentList]:
+        """
+        搜索多个关键字，默认逐个搜索，支持OR搜索的站点可以合并为一次请求
+        :param keywords:
+        :return: 关键字对应的搜索结果，合并搜索时无法分配的结果放在BATCH_UNMATCHED下
+        """
+        result = {}
+        for keyword in dict.fromkeys(k for k in keywords if k):
+            result[keyword] = await self.search(keyword, None, cate_level1_list, free, page, timeout, fields)
+        return result
+
     @abstractmethod
     async def download(self, url, filepath):
         pass
 
+    async def download_once(self, url, filepath):
+        """
+        下载一个种子，出错时不重试，批量下载时使用
+        :param url:
+        :param filepath:
+        :return: 是否下载到了种子，站点返回404时为False
+        """
+        return await self.download(url, filepath)
+
     @abstractmethod
     async def get_detail(self, url) -> Optional[TorrentDetail]:
         pass
+
+    async def get_detail_once(self, url) -> Optional[TorrentDetail]:
+        """
+        获取一个详情页，出错时不重试，批量获取时使用
+        :param url:
+        :return:
+        """
+        return await self.get_detail(url)
+
+    async def get_detail_many(self, urls: List[str], concurrency: int = 3) -> AsyncIterator[DetailResult]:
+        """
+        并发获取多个详情页，按完成先后依次返回，单个页面出错不影响其他页面，也不会重试
+        :param urls: 详情页地址，重复的地址只请求一次
+        :param concurrency: 同时进行的请求数，请求仍受站点限速
+        :return:
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def fetch(url):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    detail = await self.get_detail_once(url)
+                    return DetailResult(url, detail, runtime=round(time.perf_counter() - start, 2))
+                except Exception as e:
+                    return DetailResult(url, err_msg=str(e) or repr(e), runtime=round(time.perf_counter() - start, 2))
+
+        tasks = [asyncio.ensure_future(fetch(url)) for url in dict.fromkeys(urls)]
+        try:
+            for future in asyncio.as_completed(tasks):
+                yield await future
+        finally:
+            # 调用方提前停止迭代时取消剩余的请求
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from enum import Enum
+from typing import List, Optional, Set, Tuple, Dict
+
+import aiofiles
+
+from autoptspider.site.basesitehelper import BaseSiteHelper
+from autoptspider.utils.torrentutils import TorrentUtils
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DownloadStatus(str, Enum):
+    Downloaded = 'Downloaded'
+    Duplicate = 'Duplicate'
+    NotFound = 'NotFound'
+    Error = 'Error'
+
+
+class DownloadResult:
+    site_id: str
+    url: str
+    filepath: str
+    status: DownloadStatus
+    infohash: Optional[str]
+    err_msg: Optional[str]
+    runtime: float
+
+    def __init__(self, site_id: str, url: str, filepath: str, status: DownloadStatus, infohash: Optional[str] = None,
+                 err_msg: Optional[str] = None, runtime: float = 0):
+        self.site_id = site_id
+        self.url = url
+        self.filepath = filepath
+        self.status = status
+        self.infohash = infohash
+        self.err_msg = err_msg
+        self.runtime = runtime
+
+
+async def _download_job(site_helper: BaseSiteHelper, url: str, filepath: str, seen: Set[str]) -> DownloadResult:
+    start = time.perf_counter()
+    status = DownloadStatus.Downloaded
+    infohash = None
+    err_msg = None
+    # 先下载到同目录的临时文件，确认不是重复的种子后再改名，不会覆盖或删除其他任务保存的文件
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filepath)), suffix='.tmp')
+    os.close(fd)
+    try:
+        downloaded = await site_helper.download_once(url, tmp_path)
+        if downloaded is False or not os.path.getsize(tmp_path):
+            status = DownloadStatus.NotFound
+        else:
+            async with aiofiles.open(tmp_path, 'rb') as file:
+                infohash = TorrentUtils.get_infohash(await file.read())
+            if infohash and infohash in seen:
+                # 同一批次中已经下载过相同的种子
+                status = DownloadStatus.Duplicate
+            else:
+                if infohash:
+                    seen.add(infohash)
+                os.replace(tmp_path, filepath)
+    except Exception as e:
+        _LOGGER.info(f'{site_helper.get_name()}下载种子出错：{url} {repr(e)}')
+        status = DownloadStatus.Error
+        err_msg = str(e) or repr(e)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return DownloadResult(site_helper.get_id(), url, filepath, status, infohash, err_msg,
+                          round(time.perf_counter() - start, 2))
+
+
+async def download_many(jobs: List[Tuple[BaseSiteHelper, str, str]], concurrency: int = 1,
+                        seen: Optional[Set[str]] = None) -> List[DownloadResult]:
+    """
+    批量下载种子，不同站点并行下载，同一站点按站点限速依次下载
+    下载后按infohash去重，单个种子出错不影响其他种子，也不会重试
+    :param jobs: (站点, 下载地址, 保存路径)列表，可以包含多个站点
+    :param concurrency: 每个站点同时进行的下载数
+    :param seen: 已经有的种子infohash，下载到相同的种子时视为重复，新下载的infohash也会加入其中
+    :return: 与jobs顺序一致的下载结果
+    """
+    if seen is None:
+        seen = set()
+    results: List[Optional[DownloadResult]] = [None] * len(jobs)
+    queues: Dict[str, List[int]] = {}
+    first: Dict[Tuple[str, str], int] = {}
+    repeated: List[Tuple[int, int]] = []
+    for i, (site_helper, url, filepath) in enumerate(jobs):
+        key = (site_helper.get_id(), url)
+        if key in first:
+            # 同一站点的同一下载地址只下载一次
+            repeated.append((i, first[key]))
+            continue
+        first[key] = i
+        queues.setdefault(site_helper.get_id(), []).append(i)
+
+    async def worker(queue: List[int]):
+        while queue:
+            i = queue.pop(0)
+            site_helper, url, filepath = jobs[i]
+            results[i] = await _download_job(site_helper, url, filepath, seen)
+
+    workers = []
+    for queue in queues.values():
+        workers += [worker(queue) for _ in range(max(1, min(concurrency, len(queue))))]
+    await asyncio.gather(*workers)
+    for i, j in repeated:
+        site_helper, url, filepath = jobs[i]
+        results[i] = DownloadResult(site_helper.get_id(), url, filepath, DownloadStatus.Duplicate, results[j].infohash)
+    return results
@@ -0,0 +1,218 @@
+import datetime
+import logging
+import operator
+from functools import lru_cache
+from typing import Callable, Optional, FrozenSet
+
+from jinja2 import Environment, nodes
+
+from autoptspider.utils.stringutils import StringUtils, TEMPLATE_CACHE_SIZE
+
+_LOGGER = logging.getLogger(__name__)
+# 与jinja2.Template使用的默认环境配置一致，保证取值、未定义变量的行为相同
+_ENV = Environment()
+_COMPARE = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'gteq': operator.ge,
+    'lt': operator.lt,
+    'lteq': operator.le,
+    'in': lambda a, b: a in b,
+    'notin': lambda a, b: a not in b,
+}
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _compile_expr(node) -> Callable:
+    """
+    把表达式节点编译成接收变量查找函数的Python函数，只支持字段模版常用的表达式
+    """
+    if isinstance(node, nodes.Const):
+        value = node.value
+        return lambda lookup: value
+    if isinstance(node, nodes.Name):
+        name = node.name
+        return lambda lookup: lookup(name)
+    if isinstance(node, nodes.Getitem):
+        if isinstance(node.arg, nodes.Slice):
+            raise _Unsupported()
+        obj = _compile_expr(node.node)
+        arg = _compile_expr(node.arg)
+        return lambda lookup: _ENV.getitem(obj(lookup), arg(lookup))
+    if isinstance(node, nodes.Getattr):
+        obj = _compile_expr(node.node)
+        attr = node.attr
+        return lambda lookup: _ENV.getattr(obj(lookup), attr)
+    if isinstance(node, nodes.And):
+        left, right = _compile_expr(node.left), _compile_expr(node.right)
+        return lambda lookup: left(lookup) and right(lookup)
+    if isinstance(node, nodes.Or):
+        left, right = _compile_expr(node.left), _compile_expr(node.right)
+        return lambda lookup: left(lookup) or right(lookup)
+    if isinstance(node, nodes.Not):
+        expr = _compile_expr(node.node)
+        return lambda lookup: not expr(lookup)
+    if isinstance(node, nodes.Compare):
+        if len(node.ops) != 1 or node.ops[0].op not in _COMPARE:
+            raise _Unsupported()
+        left, right = _compile_expr(node.expr), _compile_expr(node.ops[0].expr)
+        op = _COMPARE[node.ops[0].op]
+        return lambda lookup: op(left(lookup), right(lookup))
+    if isinstance(node, nodes.CondExpr):
+        test, expr1 = _compile_expr(node.test), _compile_expr(node.expr1)
+        expr2 = _compile_expr(node.expr2) if node.expr2 is not None else lambda lookup: _ENV.undefined()
+        return lambda lookup: expr1(lookup) if test(lookup) else expr2(lookup)
+    raise _Unsupported()
+
+
+def _compile_body(body) -> Callable:
+    """
+    把语句列表编译成向输出列表追加文本的函数，只支持纯文本、输出表达式和if/elif/else
+    """
+    steps = []
+    for node in body:
+        if isinstance(node, nodes.Output):
+            for child in node.nodes:
+                if isinstance(child, nodes.TemplateData):
+                    data = child.data
+                    steps.append(lambda lookup, out, data=data: out.append(data))
+                else:
+                    expr = _compile_expr(child)
+                    steps.append(lambda lookup, out, expr=expr: out.append(str(expr(lookup))))
+        elif isinstance(node, nodes.If):
+            branches = [(_compile_expr(node.test), _compile_body(node.body))]
+            for elif_ in node.elif_:
+                branches.append((_compile_expr(elif_.test), _compile_body(elif_.body)))
+            else_ = _compile_body(node.else_)
+
+            def step(lookup, out, branches=branches, else_=else_):
+                for test, then in branches:
+                    if test(lookup):
+                        then(lookup, out)
+                        return
+                else_(lookup, out)
+
+            steps.append(step)
+        else:
+            raise _Unsupported()
+
+    def run(lookup, out):
+        for s in steps:
+            s(lookup, out)
+
+    return run
+
+
+def compile_native(source: str) -> Optional[Callable]:
+    """
+    分析模版语法，能识别的常见写法（字段引用、字段取值的if/else、条件常量等）编译为Python函数
+    不能识别时返回None
+    :param source:
+    :return:
+    """
+    try:
+        body = _compile_body(_ENV.parse(source).body)
+    except _Unsupported:
+        return
+    except Exception as e:
+        _LOGGER.debug(f'模版语法分析失败，使用Jinja渲染：{source} {repr(e)}')
+        return
+
+    def render(lookup):
+        out = []
+        body(lookup, out)
+        return ''.join(out)
+
+    return render
+
+
+def find_field_refs(source: str) -> Optional[FrozenSet[str]]:
+    """
+    找出模版通过fields['x']或fields.x引用的字段
+    :param source:
+    :return: 以其他方式使用fields（如动态下标、整体传递）时无法确定，返回None
+    """
+    try:
+        ast = _ENV.parse(source)
+    except Exception:
+        return
+    refs = set()
+    used = 0
+    for node in ast.find_all((nodes.Getitem, nodes.Getattr)):
+        if not isinstance(node.node, nodes.Name) or node.node.name != 'fields':
+            continue
+        if isinstance(node, nodes.Getattr):
+            refs.add(node.attr)
+        elif isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+            refs.add(node.arg.value)
+        else:
+            continue
+        used += 1
+    if used != sum(1 for n in ast.find_all(nodes.Name) if n.name == 'fields'):
+        return
+    return frozenset(refs)
+
+
+class FieldTemplate:
+    """
+    字段规则中的模版，优先使用原生编译结果，不能识别的写法仍交给Jinja渲染
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.field_refs = find_field_refs(source)
+        self.native = compile_native(source)
+        self.template = None if self.native else StringUtils.get_template(source)
+
+    def render(self, values: dict, context: Optional[dict] = None, **extra) -> str:
+        """
+        渲染模版，变量与Jinja渲染时一致：fields、now、额外变量，context中的同名变量优先
+        :param values: 已解析出的字段值
+        :param context: 额外上下文
+        :param extra: 其他内置变量，如max_time
+        :return:
+        """
+        if not self.native:
+            ctx = {'fields': values, 'now': datetime.datetime.now()}
+            ctx.update(extra)
+            if context:
+                ctx.update(context)
+            return self.template.render(ctx)
+        now = []
+
+        def lookup(name):
+            if context and name in context:
+                return context[name]
+            if name == 'fields':
+                return values
+            if name == 'now':
+                if not now:
+                    now.append(datetime.datetime.now())
+                return now[0]
+            if name in extra:
+                return extra[name]
+            if name in _ENV.globals:
+                return _ENV.globals[name]
+            return _ENV.undefined(name=name)
+
+        return self.native(lookup)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _get_field_template(text: str) -> FieldTemplate:
+    return FieldTemplate(text)
+
+
+def get_field_template(text) -> Optional[FieldTemplate]:
+    """
+    获取字段模版，按模版原文在进程内共享，不含模版语法时返回None
+    :param text:
+    :return:
+    """
+    if not isinstance(text, str) or text.find('{') == -1:
+        return
+    return _get_field_template(text)
@@ -6,6 +6,7 @@ import urllib
 from pyquery import PyQuery
 
 from autoptspider.site.siteexceptions import SiteParseFieldException
+from autoptspider.utils.stringutils import StringUtils
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -29,18 +30,26 @@ def filter_split(value, args):
     return None
 
 
-def filter_re_search(value, args):
-    result = re.search(args[0], value)
+def _re_search(pattern, group, value):
+    result = pattern.search(value)
     if result:
-        if args[1] <= len(result.groups()):
-            return result.group(args[1])
+        if group <= len(result.groups()):
+            return result.group(group)
         else:
             return
     return
 
 
+def filter_re_search(value, args):
+    return _re_search(re.compile(args[0]), args[1], value)
+
+
+_DATE_ELAPSED_RE = re.compile(r'(?:(\d+)日)?(?:(\d+)[時时])?(?:(\d+)分)?')
+_DATE_ELAPSED_EN_RE = re.compile(r'([\d\.]+)\s(seconds|minutes|hours|days|weeks|years)\sago')
+
+
 def filter_parse_date_elapsed(value, args) -> datetime:
-    t = re.match(r'(?:(\d+)日)?(?:(\d+)[時时])?(?:(\d+)分)?', value)
+    t = _DATE_ELAPSED_RE.match(value)
     if not t:
         return None
     now = datetime.datetime.now()
@@ -57,7 +66,7 @@ def filter_parse_date_elapsed_en(value, args):
     if not value:
         return
     value = str(value).strip()
-    t = re.match(r'([\d\.]+)\s(seconds|minutes|hours|days|weeks|years)\sago', value)
+    t = _DATE_ELAPSED_EN_RE.match(value)
     if not t:
         return
     now = datetime.datetime.now()
@@ -82,32 +91,38 @@ def filter_regexp(value, args):
     return re.sub(args, '', value)
 
 
-def filter_dateparse(value, args):
+def _dateparse_formats(args):
+    if isinstance(args, list):
+        return args
+    return [str(args)]
+
+
+def _dateparse(value, formats):
     if not value:
         return datetime.datetime.now()
     value = str(value)
-    if isinstance(args, list):
-        args = args
-    else:
-        args = [str(args)]
-    for f in args:
+    for f in formats:
         try:
             try:
                 return datetime.datetime.strptime(value, f)
             except ValueError as e:
                 if value.startswith('今天'):
                     value = value.replace('今天', datetime.datetime.now().strftime('%Y-%m-%d'))
-                    return filter_dateparse(value, args)
+                    return _dateparse(value, formats)
                 elif value.startswith('昨天'):
                     value = value.replace('昨天',
                                           (datetime.datetime.now() - datetime.timedelta(days=-1)).strftime('%Y-%m-%d'))
-                    return filter_dateparse(value, args)
+                    return _dateparse(value, formats)
                 raise e
         except ValueError as e:
             continue
     return
 
 
+def filter_dateparse(value, args):
+    return _dateparse(value, _dateparse_formats(args))
+
+
 filter_handler = {
     'lstrip': lambda val, args: str(val).lstrip(str(args[0])),
     'rstrip': lambda val, args: str(val).rstrip(str(args[0])),
@@ -126,6 +141,67 @@ filter_handler = {
 }
 
 
+def _compile_re_search(args):
+    pattern = re.compile(args[0])
+    group = args[1]
+    return lambda val: _re_search(pattern, group, val)
+
+
+def _compile_regexp(args):
+    pattern = re.compile(args)
+    return lambda val: pattern.sub('', val)
+
+
+def _compile_dateparse(args):
+    formats = _dateparse_formats(args)
+    return lambda val: _dateparse(val, formats)
+
+
+def _compile_strip(method, args):
+    chars = str(args[0])
+    return lambda val: getattr(str(val), method)(chars)
+
+
+def _bind(handler, args):
+    return lambda val: handler(val, args)
+
+
+# 过滤器编译函数，参数在加载适配文件时预先处理好（正则预编译、日期格式预先整理），返回只接收值的函数
+filter_compiler = {
+    'lstrip': lambda args: _compile_strip('lstrip', args),
+    'rstrip': lambda args: _compile_strip('rstrip', args),
+    'dateparse': _compile_dateparse,
+    're_search': _compile_re_search,
+    'regexp': _compile_regexp,
+}
+
+
+def compile_filters(filters):
+    """
+    把字段规则的过滤器配置编译为一个函数，执行结果与HtmlParser._filter_value一致
+    :param filters:
+    :return:
+    """
+    if not filters:
+        return
+    chain = []
+    for f in filters:
+        name = f['name']
+        if name in filter_compiler:
+            chain.append(filter_compiler[name](f.get('args')))
+        elif name in filter_handler:
+            chain.append(_bind(filter_handler[name], f.get('args')))
+
+    def _filter(value):
+        if not value:
+            return value
+        for fn in chain:
+            value = fn(value)
+        return value
+
+    return _filter
+
+
 class HtmlParser:
     @staticmethod
     def _select_value(tag: PyQuery, rule):
@@ -191,8 +267,8 @@ class HtmlParser:
             val = None
             try:
                 if 'text' in rule:
-                    if '_template' in rule:
-                        tmpl = rule['_template']
+                    tmpl = StringUtils.get_template(rule['text'])
+                    if tmpl:
                         ctx = {'fields': values, 'now': datetime.datetime.now()}
                         if context:
                             ctx.update(context)
@@ -216,8 +292,8 @@ class HtmlParser:
                 if 'filters' in rule:
                     val = self._filter_value(val, rule['filters'])
                 if not val and 'default_value' in rule:
-                    if '_default_value_template' in rule:
-                        tmpl = rule['_default_value_template']
+                    tmpl = StringUtils.get_template(rule['default_value'])
+                    if tmpl:
                         ctx = {'fields': values, 'now': datetime.datetime.now(), 'max_time': datetime.datetime.max}
                         if context:
                             ctx.update(context)
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Union, Tuple
+
+from pyquery import PyQuery
+
+from autoptspider.site.ruleplan import SitePlan
+from autoptspider.site.siteparser import SiteParser
+
+_LOGGER = logging.getLogger(__name__)
+PAGE_TORRENTS = 'torrents'
+PAGE_LIST = 'list'
+PAGE_DETAIL = 'detail'
+PAGE_USERINFO = 'userinfo'
+
+
+def parse_page(plan: SitePlan, content: bytes, page: str, userinfo: Optional[dict] = None,
+               trim: Optional[bool] = None, fields: Optional[Tuple[str, ...]] = None) -> Optional[dict]:
+    """
+    解析一个页面，只返回普通的dict和list，可以在线程或进程中执行
+    :param plan: 站点执行计划
+    :param content: 响应原始字节
+    :param page: 页面类型，torrents搜索结果页、list最新种子页、detail详情页、userinfo用户信息页
+    :param userinfo: 已知的用户信息，为空时种子列表页会同时解析用户信息
+    :param trim: 是否按适配文件预裁剪页面，默认只裁剪种子列表页
+    :param fields: 种子列表只解析这些字段及其依赖的字段，为空时解析全部
+    :return: 页面为空时返回None
+    """
+    if trim is None:
+        trim = page in (PAGE_TORRENTS, PAGE_LIST)
+    doc = plan.parse_html(content, trim=trim)
+    if doc is None:
+        return
+    site_config = plan.site_config
+    torrents_rule = site_config.get('list') if page == PAGE_LIST else None
+    torrents_plan = plan.project(page, fields) if page in (PAGE_TORRENTS, PAGE_LIST) else None
+    with SiteParser(site_config, PyQuery(doc), torrents_rule, plan=plan, torrents_plan=torrents_plan) as parser:
+        if page == PAGE_DETAIL:
+            return {'detail': parser.parse_detail()}
+        if page == PAGE_USERINFO:
+            return {'userinfo': parser.parse_userinfo()}
+        if not userinfo:
+            userinfo = parser.parse_userinfo()
+        return {'userinfo': userinfo, 'items': parser.parse_torrent_items(context={'userinfo': userinfo})}
+
+
+class ParseExecutor:
+    """
+    页面解析执行器，默认直接在当前协程中解析
+    """
+    name = 'inline'
+
+    async def run(self, fn, *args):
+        return fn(*args)
+
+
+class PoolParseExecutor(ParseExecutor):
+    """
+    在线程池或进程池中解析页面，解析期间事件循环可以继续处理其他站点的请求
+    """
+
+    def __init__(self, name: str, executor: Executor):
+        self.name = name
+        self.executor = executor
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+
+@lru_cache(maxsize=None)
+def _get_parse_executor(name: str, pid: int) -> ParseExecutor:
+    if name == 'thread':
+        return PoolParseExecutor(name, ThreadPoolExecutor(thread_name_prefix='SiteParser'))
+    if name == 'process':
+        return PoolParseExecutor(name, ProcessPoolExecutor())
+    return ParseExecutor()
+
+
+def get_parse_executor(executor: Union[None, str, ParseExecutor] = None) -> ParseExecutor:
+    """
+    获取解析执行器，同一进程内同名执行器共享一个线程池或进程池
+    :param executor: inline、thread、process，或自定义的ParseExecutor
+    :return:
+    """
+    if isinstance(executor, ParseExecutor):
+        return executor
+    if executor and executor not in ('inline', 'thread', 'process'):
+        _LOGGER.warning(f'不支持的解析执行器{executor}，使用inline')
+        executor = None
+    # fork出的子进程不能使用父进程创建的线程池和进程池，按进程号区分
+    return _get_parse_executor(executor or 'inline', os.getpid())
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from typing import Optional, Dict, Tuple
+
+_LOGGER = logging.getLogger(__name__)
+REQUEST = 'request'
+DOWNLOAD = 'download'
+# 配置了限速时未填写的项取这里的默认值，单位为每秒请求数
+DEFAULT_RATES = {
+    REQUEST: {'rate': 2, 'min_rate': 1 / 60, 'max_rate': 5, 'increase': 0.1, 'decrease': 0.5},
+    DOWNLOAD: {'rate': 1 / 15, 'min_rate': 1 / 120, 'max_rate': 1 / 15, 'increase': 0.01, 'decrease': 0.5},
+}
+# 未配置限速时也限速的请求类型，下载沿用原来15秒一次的限制，普通请求不限速
+LIMITED_BY_DEFAULT = (DOWNLOAD,)
+# 不限速，只在站点要求暂停时等待
+UNLIMITED = {'rate': math.inf, 'min_rate': math.inf, 'max_rate': math.inf, 'increase': 0, 'decrease': 1}
+
+
+class AdaptiveRateLimiter:
+    """
+    自适应限速器，按当前速率依次发放请求时间
+    站点提示负载过高或请求过多时速率按比例降低（乘性减），之后每次请求成功缓慢提高（加性增）
+    不绑定事件循环，同一进程内的多个SiteHelper、多个线程可以共用
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, increase: float, decrease: float):
+        self._next = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.configure(rate, min_rate, max_rate, increase, decrease)
+
+    def configure(self, rate: float, min_rate: float, max_rate: float, increase: float, decrease: float):
+        with self._lock:
+            self.config = {'rate': rate, 'min_rate': min_rate, 'max_rate': max_rate, 'increase': increase,
+                           'decrease': decrease}
+            self.min_rate = min_rate
+            self.max_rate = max(max_rate, min_rate)
+            self.rate = min(max(rate, self.min_rate), self.max_rate)
+            self.increase = increase
+            self.decrease = decrease
+
+    async def acquire(self):
+        """
+        等待到下一个可用的请求时间
+        :return:
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = end = slot + 1 / self.rate
+        if slot > now:
+            try:
+                await asyncio.sleep(slot - now)
+            except asyncio.CancelledError:
+                with self._lock:
+                    # 等待被取消（如到达截止时间）时归还请求时间，后面的请求不用多等
+                    if self._next == end:
+                        self._next = slot
+                raise
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_overload(self, pause: Optional[float] = None):
+        """
+        站点提示负载过高或请求过多时调用
+        :param pause: 站点要求暂停的秒数，期间不再发放请求
+        :return:
+        """
+        with self._lock:
+            now = time.monotonic()
+            # 同一批并发请求同时报错时只降一次速
+            if now - self._last_decrease >= 1 / self.rate:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._last_decrease = now
+            self._next = max(self._next, now + (pause if pause else 1 / self.rate))
+
+
+_LIMITERS: Dict[Tuple[str, str], AdaptiveRateLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(site_id: str, kind: str, rate_config: Optional[dict] = None) -> AdaptiveRateLimiter:
+    """
+    获取站点的限速器，同一进程内同一站点的同类请求共用一个
+    传入的配置与当前不同时按新配置调整，未传入配置时沿用已有的限速器
+    从未配置过的普通请求不限速，下载默认15秒一次
+    :param site_id: 站点编号
+    :param kind: request普通请求，download下载种子
+    :param rate_config: 适配文件中rate_limit下对应类型的配置
+    :return:
+    """
+    key = (site_id, kind)
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(key)
+        if limiter is not None and not rate_config:
+            return limiter
+        if rate_config:
+            config = dict(DEFAULT_RATES[kind])
+            config.update({k: float(v) for k, v in rate_config.items() if k in config})
+        elif kind in LIMITED_BY_DEFAULT:
+            config = dict(DEFAULT_RATES[kind])
+        else:
+            config = dict(UNLIMITED)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(**config)
+            _LIMITERS[key] = limiter
+        elif limiter.config != config:
+            limiter.configure(**config)
+        return limiter
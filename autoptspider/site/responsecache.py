@@ -0,0 +1,212 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Union
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CachedResponse:
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+    def __init__(self, content: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None,
+                 stored_at: Optional[float] = None):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at if stored_at is not None else time.time()
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time.time() - self.stored_at < ttl
+
+    def validators(self) -> Dict[str, str]:
+        """
+        条件请求头，站点返回过ETag或Last-Modified时才有
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    页面响应缓存，按站点、地址和Cookie区分，子类实现具体的存储方式
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._counter_lock = threading.Lock()
+
+    @staticmethod
+    def build_key(site_id: str, url: str, cookie_str: Optional[str]) -> str:
+        identity = hashlib.sha1((cookie_str or '').encode('utf-8')).hexdigest()
+        return f'{site_id}|{identity}|{url}'
+
+    def count(self, name: str):
+        with self._counter_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'revalidated': self.revalidated}
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        raise NotImplementedError()
+
+    def set(self, key: str, response: CachedResponse):
+        raise NotImplementedError()
+
+    def delete(self, key: str):
+        raise NotImplementedError()
+
+
+class MemoryResponseCache(ResponseCache):
+    """
+    进程内LRU缓存
+    """
+
+    def __init__(self, maxsize: int = 256):
+        super().__init__()
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            response = self._data.get(key)
+            if response is not None:
+                self._data.move_to_end(key)
+            return response
+
+    def set(self, key: str, response: CachedResponse):
+        with self._lock:
+            self._data[key] = response
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class DiskResponseCache(ResponseCache):
+    """
+    磁盘缓存，多个进程可以共用同一个目录
+    每个响应存为两个文件：.body为响应原始字节，.json为ETag等元数据，不反序列化任何对象
+    超过条数或总字节数上限时，按最近使用时间删除最旧的缓存
+    """
+
+    def __init__(self, directory: str, max_entries: int = 1024, max_bytes: int = 256 * 1024 * 1024):
+        super().__init__()
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        """
+        缓存文件的路径前缀，加上.body或.json后缀为实际文件
+        """
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        path = self._path(key)
+        if not os.path.exists(path + '.json'):
+            return
+        try:
+            with open(path + '.json', 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            with open(path + '.body', 'rb') as file:
+                content = file.read()
+            # 其他进程同时写入时两个文件可能不配套，当作没有缓存
+            if meta.get('key') != key or meta.get('size') != len(content):
+                return
+            # 更新修改时间，淘汰时按最近使用排序
+            os.utime(path + '.json')
+            return CachedResponse(content, meta.get('etag'), meta.get('last_modified'), float(meta['stored_at']))
+        except Exception as e:
+            _LOGGER.debug(f'读取缓存文件{path}失败：{repr(e)}')
+            return
+
+    def _write(self, path: str, data: bytes):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def set(self, key: str, response: CachedResponse):
+        path = self._path(key)
+        meta = {'key': key, 'etag': response.etag, 'last_modified': response.last_modified,
+                'stored_at': response.stored_at, 'size': len(response.content)}
+        # 先写内容再写元数据，读取时以元数据为准
+        self._write(path + '.body', response.content)
+        self._write(path + '.json', json.dumps(meta).encode('utf-8'))
+        self._evict()
+
+    def delete(self, key: str):
+        path = self._path(key)
+        for suffix in ('.json', '.body'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def _evict(self):
+        """
+        超过条数或总字节数上限时，从最久未使用的缓存开始删除
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name[:-len('.json')])
+            try:
+                size = os.path.getsize(path + '.body') + os.path.getsize(path + '.json')
+                entries.append((os.path.getmtime(path + '.json'), size, path))
+            except OSError:
+                continue
+            total += size
+        entries.sort()
+        while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+            _, size, path = entries.pop(0)
+            total -= size
+            for suffix in ('.json', '.body'):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+
+
+_CACHES: Dict[str, ResponseCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_response_cache(cache: Union[None, str, ResponseCache] = None) -> Optional[ResponseCache]:
+    """
+    获取页面缓存，同一进程内同名缓存共用一个，缓存键中包含站点编号，多个站点可以共用
+    :param cache: memory进程内缓存，其他字符串视为磁盘缓存目录，或自定义的ResponseCache
+    :return: 未指定时返回None，不缓存
+    """
+    if cache is None or isinstance(cache, ResponseCache):
+        return cache
+    with _CACHES_LOCK:
+        if cache not in _CACHES:
+            _CACHES[cache] = MemoryResponseCache() if cache == 'memory' else DiskResponseCache(cache)
+        return _CACHES[cache]
@@ -0,0 +1,155 @@
+import codecs
+import re
+from enum import Enum
+from typing import Optional, List, Dict, Union
+
+# 未配置时只检查响应开头和结尾的字节数，页面不超过两倍时检查全部内容
+DEFAULT_SCAN_SIZE = 16 * 1024
+
+
+class ResponseKind(str, Enum):
+    Ok = 'Ok'
+    # 基本的水墙，页面js跳转到检查地址
+    CloudflareRedirect = 'CloudflareRedirect'
+    # 5秒盾，需要浏览器访问
+    CloudflareChallenge = 'CloudflareChallenge'
+    Overload = 'Overload'
+    RateLimited = 'RateLimited'
+    DownloadNotice = 'DownloadNotice'
+
+
+# 同时命中多种时按此顺序取第一种
+KIND_ORDER = [ResponseKind.CloudflareChallenge, ResponseKind.CloudflareRedirect, ResponseKind.Overload,
+              ResponseKind.RateLimited, ResponseKind.DownloadNotice]
+# 每种结果的标记，一个标记可以是字符串，或需要同时出现的多个字符串
+DEFAULT_MARKERS = {
+    ResponseKind.CloudflareChallenge: ['<title>Just a moment...</title>'],
+    ResponseKind.CloudflareRedirect: [['data-cf-settings', 'rocket-loader']],
+    ResponseKind.Overload: ['负载过高，120秒后自动刷新'],
+    ResponseKind.RateLimited: ['请求次数过多'],
+    ResponseKind.DownloadNotice: ['下载提示', '下載輔助說明'],
+}
+_CONFIG_KEYS = {
+    'cloudflare_challenge': ResponseKind.CloudflareChallenge,
+    'cloudflare_redirect': ResponseKind.CloudflareRedirect,
+    'overload': ResponseKind.Overload,
+    'rate_limited': ResponseKind.RateLimited,
+    'download_notice': ResponseKind.DownloadNotice,
+}
+_REDIRECT_RE = re.compile(rb'window.location=(.+);')
+_JS_STRING_RE = re.compile(r'\s*(?:"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\')\s*')
+
+
+def parse_js_string_expression(expression: str) -> Optional[str]:
+    """
+    解析由字符串字面量和+拼接成的js表达式，不执行任何代码
+    :param expression: 如 "/cdn-cgi/" + 'check?a=1'
+    :return: 出现字符串拼接之外的内容时返回None
+    """
+    parts = []
+    pos = 0
+    while True:
+        match = _JS_STRING_RE.match(expression, pos)
+        if not match:
+            return
+        literal = match.group(1) if match.group(1) is not None else match.group(2)
+        try:
+            parts.append(codecs.decode(literal, 'unicode_escape') if '\\' in literal else literal)
+        except UnicodeDecodeError:
+            return
+        pos = match.end()
+        if pos == len(expression):
+            return ''.join(parts)
+        if expression[pos] != '+':
+            return
+        pos += 1
+
+
+class ResponseVerdict:
+    kind: ResponseKind
+    marker: Optional[str]
+    redirect: Optional[str]
+
+    def __init__(self, kind: ResponseKind, marker: Optional[str] = None, redirect: Optional[str] = None):
+        self.kind = kind
+        self.marker = marker
+        self.redirect = redirect
+
+    def __repr__(self):
+        return f'ResponseVerdict({self.kind.value}, {self.marker!r})'
+
+
+OK = ResponseVerdict(ResponseKind.Ok)
+
+
+class ResponseClassifier:
+    """
+    一次扫描识别水墙、负载过高、请求过多、下载提示等特殊页面，直接在原始字节上查找，不解码整个页面
+    """
+
+    def __init__(self, markers_config: Optional[dict] = None, encoding: Optional[str] = None):
+        """
+        :param markers_config: 适配文件中的response_markers，配置了的种类替换默认标记
+        :param encoding: 站点编码，标记按站点编码和UTF-8分别查找
+        """
+        markers_config = markers_config or {}
+        self.scan_size = int(markers_config.get('scan_size') or DEFAULT_SCAN_SIZE)
+        self.encoding = encoding or 'utf-8'
+        markers: Dict[ResponseKind, List[Union[str, List[str]]]] = dict(DEFAULT_MARKERS)
+        for key, kind in _CONFIG_KEYS.items():
+            if markers_config.get(key) is not None:
+                markers[kind] = markers_config.get(key)
+        encodings = list(dict.fromkeys([self.encoding.lower(), 'utf-8']))
+        # 每个标记字符串编码后的字节对应原字符串
+        self._strings: Dict[bytes, str] = {}
+        self._markers: List[tuple] = []
+        for kind in KIND_ORDER:
+            for marker in markers.get(kind) or []:
+                parts = [marker] if isinstance(marker, str) else list(marker)
+                self._markers.append((kind, parts))
+                for part in parts:
+                    for e in encodings:
+                        try:
+                            self._strings[part.encode(e)] = part
+                        except (UnicodeEncodeError, LookupError):
+                            continue
+        patterns = sorted(self._strings, key=len, reverse=True)
+        self._pattern = re.compile(b'|'.join(re.escape(p) for p in patterns)) if patterns else None
+
+    def _windows(self, content: bytes) -> List[bytes]:
+        if len(content) <= self.scan_size * 2:
+            return [content]
+        return [content[:self.scan_size], content[-self.scan_size:]]
+
+    def classify(self, status_code: int, content: Optional[bytes]) -> ResponseVerdict:
+        """
+        识别响应类型
+        :param status_code: 响应状态码
+        :param content: 响应原始字节
+        :return:
+        """
+        found = set()
+        windows = self._windows(content or b'')
+        if self._pattern is not None:
+            for window in windows:
+                found.update(self._strings[m.group(0)] for m in self._pattern.finditer(window))
+        for kind, parts in self._markers:
+            if not all(p in found for p in parts):
+                continue
+            if kind == ResponseKind.CloudflareChallenge and status_code != 503:
+                continue
+            if kind == ResponseKind.CloudflareRedirect:
+                redirect = self._find_redirect(windows)
+                if not redirect:
+                    continue
+                return ResponseVerdict(kind, parts[0], redirect)
+            return ResponseVerdict(kind, parts[0])
+        if status_code == 429:
+            return ResponseVerdict(ResponseKind.RateLimited)
+        return OK
+
+    def _find_redirect(self, windows: List[bytes]) -> Optional[str]:
+        for window in windows:
+            match = _REDIRECT_RE.search(window)
+            if match:
+                return parse_js_string_expression(match.group(1).decode(self.encoding, errors='replace'))
@@ -0,0 +1,650 @@
+import datetime
+import logging
+import re
+from functools import lru_cache
+from typing import Optional, List, Tuple, Dict, FrozenSet, Iterable
+
+from cssselect import SelectorError, parse
+from cssselect.parser import CombinedSelector, Element, Class, Attrib
+import lxml.html
+from lxml import etree
+from pyquery import PyQuery
+from pyquery.cssselectpatch import JQueryTranslator
+from pyquery.text import extract_text
+
+from autoptspider.site.fieldtemplate import get_field_template
+from autoptspider.site.htmlparser import HtmlParser, compile_filters
+from autoptspider.site.siteexceptions import SiteParseFieldException
+from autoptspider.utils.stringutils import StringUtils
+
+_LOGGER = logging.getLogger(__name__)
+_TRANSLATOR = JQueryTranslator(xhtml=False)
+_PREFIX = 'descendant-or-self::'
+
+
+@lru_cache(maxsize=2048)
+def _translate_selector(selector: str, prefix: str = _PREFIX) -> Optional[Tuple[str, ...]]:
+    if not selector or not isinstance(selector, str):
+        return
+    try:
+        return tuple(_TRANSLATOR.selector_to_xpath(s, prefix, translate_pseudo_elements=True)
+                     for s in parse(selector.replace('[@', '[')))
+    except SelectorError:
+        return
+
+
+@lru_cache(maxsize=2048)
+def compile_selector(selector: str) -> Optional[etree.XPath]:
+    """
+    把CSS选择器翻译成可直接在lxml节点上执行的XPath对象，同一个选择器全进程只翻译一次
+    翻译规则与PyQuery保持一致，翻译失败时返回None，由调用方退回PyQuery执行
+    :param selector:
+    :return:
+    """
+    paths = _translate_selector(selector)
+    if not paths:
+        return
+    try:
+        return etree.XPath(' | '.join(paths))
+    except etree.XPathError:
+        return
+
+
+@lru_cache(maxsize=2048)
+def compile_column_selector(selector: str) -> Optional[Tuple[etree.XPath, int]]:
+    """
+    编译可在整页上执行一次、再按所属行分配结果的字段选择器
+    只支持单个选择器且只用子元素组合符(>)连接，返回XPath和最左侧元素相对匹配节点的层数
+    其他选择器（后代、兄弟组合符或依赖位置的伪类）返回None，由调用方逐行执行
+    执行起点是行的父节点，本身不会是合法的起始元素，所以用descendant轴代替descendant-or-self轴
+    :param selector:
+    :return:
+    """
+    paths = _translate_selector(selector, 'descendant::')
+    if not paths or len(paths) != 1 or 'position()' in paths[0] or 'last()' in paths[0]:
+        return
+    try:
+        tree = parse(selector.replace('[@', '['))[0].parsed_tree
+    except SelectorError:
+        return
+    depth = 0
+    while isinstance(tree, CombinedSelector):
+        if tree.combinator != '>':
+            return
+        depth += 1
+        tree = tree.selector
+    try:
+        return etree.XPath(paths[0]), depth
+    except etree.XPathError:
+        return
+
+
+_WHITESPACE = re.compile('[ \t\r\n]+')
+_SIMPLE_OPERATORS = {
+    'exists': lambda values, expect: bool(values),
+    '=': lambda values, expect: expect in values,
+    '^=': lambda values, expect: bool(expect) and any(v.startswith(expect) for v in values),
+    '$=': lambda values, expect: bool(expect) and any(v.endswith(expect) for v in values),
+    '*=': lambda values, expect: bool(expect) and any(expect in v for v in values),
+    'class': lambda tokens, expect: expect in tokens,
+}
+
+
+class SimpleKey:
+    """
+    只由标签名加一个class或属性条件组成的选择器，如img.pro_free、a[class^="VIP"]
+    不需要执行XPath，扫描一遍条目内节点的class和属性即可判断是否命中
+    """
+
+    def __init__(self, tag: Optional[str], attribute: Optional[str], operator: str, value: Optional[str]):
+        self.tag = tag
+        self.attribute = attribute
+        self.operator = operator
+        self.value = value
+
+    def match(self, scanned: Dict) -> bool:
+        # class条件对应的是扫描时拆分好的class集合
+        values = scanned.get((self.tag, '.' if self.operator == 'class' else self.attribute))
+        if not values:
+            return False
+        return _SIMPLE_OPERATORS[self.operator](values, self.value)
+
+
+@lru_cache(maxsize=2048)
+def compile_simple_key(selector: str) -> Optional[SimpleKey]:
+    """
+    识别可用扫描方式判断的简单选择器，标签名和属性名按HTML规则转小写，与CSS翻译结果一致
+    :param selector:
+    :return:
+    """
+    try:
+        selectors = parse(selector)
+    except SelectorError:
+        return
+    if len(selectors) != 1 or selectors[0].pseudo_element:
+        return
+    tree = selectors[0].parsed_tree
+    attribute, operator, value = None, 'exists', None
+    if isinstance(tree, Class):
+        attribute, operator, value = 'class', 'class', tree.class_name
+        tree = tree.selector
+    elif isinstance(tree, Attrib):
+        if tree.namespace or tree.operator not in _SIMPLE_OPERATORS:
+            return
+        attribute, operator = tree.attrib.lower(), tree.operator
+        value = tree.value.value if tree.value is not None else None
+        tree = tree.selector
+    if not isinstance(tree, Element) or tree.namespace:
+        return
+    return SimpleKey(tree.element.lower() if tree.element else None, attribute, operator, value)
+
+
+class CaseScan:
+    """
+    一组简单选择器的扫描器，一次遍历收集条目内相关节点的class和属性值
+    """
+
+    def __init__(self, keys: List[SimpleKey]):
+        self.any_tag = any(k.tag is None for k in keys)
+        self.tags = tuple(sorted({k.tag for k in keys if k.tag}))
+        self.attributes = tuple(sorted({k.attribute for k in keys if k.attribute}))
+        self.tag_only = any(k.attribute is None for k in keys)
+
+    def scan(self, elements: List) -> Dict:
+        scanned = {}
+        for root in elements:
+            for e in root.iter(etree.Element) if self.any_tag else root.iter(*self.tags):
+                tag = e.tag
+                keys = (tag, None) if self.any_tag else (tag,)
+                if self.tag_only:
+                    for t in keys:
+                        scanned.setdefault((t, None), []).append('')
+                for attr in self.attributes:
+                    v = e.get(attr)
+                    if v is None:
+                        continue
+                    for t in keys:
+                        scanned.setdefault((t, attr), []).append(v)
+                        if attr == 'class':
+                            scanned.setdefault((t, '.'), set()).update(_WHITESPACE.split(v))
+        return scanned
+
+
+def select(elements: List, xpath: etree.XPath) -> List:
+    """
+    在一组lxml节点上执行已编译的XPath，行为等同于PyQuery(elements)(selector)
+    :param elements:
+    :param xpath:
+    :return:
+    """
+    if len(elements) == 1:
+        return xpath(elements[0])
+    result = []
+    for e in elements:
+        result.extend(xpath(e))
+    return result
+
+
+def element_text(tags: List) -> str:
+    """
+    取一组节点的文本，行为等同于PyQuery.text()
+    :param tags:
+    :return:
+    """
+    if not tags:
+        return ''
+    return ' '.join(
+        PyQuery(tag).html() if tag.tag == 'textarea' else extract_text(tag) for tag in tags
+    )
+
+
+class FieldPlan:
+    """
+    单个字段规则的编译结果
+    """
+
+    def __init__(self, key: str, rule: dict, trim_emoji: bool = True):
+        self.key = key
+        self.rule = rule
+        self.trim_emoji = trim_emoji
+        self.xpath: Optional[etree.XPath] = None
+        self.case = None
+        if 'text' in rule:
+            self.kind = 'text'
+        elif 'selector' in rule:
+            self.kind = 'selector'
+            self.xpath = compile_selector(rule['selector'])
+        elif 'selectors' in rule:
+            self.kind = 'selectors'
+            self.xpath = compile_selector(rule['selectors'])
+        elif 'case' in rule:
+            self.kind = 'case'
+            self.case = [(ck, compile_selector(ck) if ck != '*' else None, compile_simple_key(ck) if ck != '*' else None,
+                          rule['case'][ck]) for ck in rule['case']]
+        else:
+            self.kind = None
+        self.template = get_field_template(rule.get('text'))
+        self.default_value_template = get_field_template(rule.get('default_value'))
+        self.filters = compile_filters(rule.get('filters'))
+
+    @property
+    def depends(self) -> Optional[FrozenSet[str]]:
+        """
+        模版引用的其他字段，无法确定时返回None
+        """
+        refs = frozenset()
+        for template in (self.template, self.default_value_template):
+            if template is None:
+                continue
+            if template.field_refs is None:
+                return
+            refs |= template.field_refs
+        return refs
+
+    @staticmethod
+    def _select_value(tags: List, rule):
+        if not tags:
+            return
+        if 'remove' in rule:
+            # remove会修改文档树，较少使用，直接交给PyQuery处理
+            return HtmlParser._select_value(PyQuery(tags), rule)
+        val = None
+        if 'attribute' in rule:
+            val = tags[0].get(rule['attribute'])
+        elif 'method' in rule:
+            if rule['method'] == 'next_sibling':
+                val = tags[0].tail
+        elif 'contents' in rule:
+            e = tags[0].xpath('child::text()|child::*')[rule['contents']]
+            if hasattr(e, 'text'):
+                val = e.text
+            else:
+                val = str(e)
+        else:
+            val = element_text(tags)
+        if val:
+            val = val.strip()
+        return val
+
+    def _select(self, elements: List, selector: str):
+        if self.xpath is not None:
+            return select(elements, self.xpath)
+        # 无法编译的选择器退回PyQuery，选择器语法错误也会在这里按原方式抛出
+        return list(PyQuery(elements)(selector))
+
+    def _case_matched(self, elements: List, ck: str, xpath: Optional[etree.XPath]) -> bool:
+        if xpath is not None:
+            return bool(select(elements, xpath))
+        return bool(PyQuery(elements)(ck))
+
+    def _case_value(self, elements: List, matched: Optional[Dict[str, bool]] = None, scanned: Optional[Dict] = None):
+        for ck, xpath, simple, value in self.case:
+            if ck == '*':
+                return value
+            if simple is not None and scanned is not None:
+                if simple.match(scanned):
+                    return value
+            elif matched is not None and ck in matched:
+                if matched[ck]:
+                    return value
+            elif self._case_matched(elements, ck, xpath):
+                return value
+        return
+
+    def evaluate(self, elements: List, values: dict, context=None, selected=None, scanned=None):
+        """
+        计算字段值
+        :param elements: 条目对应的lxml节点
+        :param values: 已解析出的字段值，供模版引用
+        :param context: 模版渲染的额外上下文
+        :param selected: 按列批量执行时预先选出的节点，case规则为各条件的命中情况
+        :param scanned: 条目内节点class和属性的扫描结果，供case规则的简单选择器使用
+        :return:
+        """
+        rule = self.rule
+        val = None
+        if self.kind == 'text':
+            if self.template:
+                val = self.template.render(values, context)
+            else:
+                val = rule.get('text')
+        elif self.kind == 'selector':
+            tags = selected if selected is not None else self._select(elements, rule['selector'])
+            val = self._select_value(tags, rule)
+            if self.trim_emoji and val:
+                val = StringUtils.trim_emoji(val)
+        elif self.kind == 'selectors':
+            tag_list = selected if selected is not None else self._select(elements, rule['selectors'])
+            if rule.get('index'):
+                if tag_list and rule['index'] < len(tag_list):
+                    val = self._select_value([tag_list[rule['index']]], rule)
+                    if self.trim_emoji and val:
+                        val = StringUtils.trim_emoji(val)
+            else:
+                val = [self._select_value([tag], rule) for tag in tag_list]
+                if self.trim_emoji:
+                    val = [StringUtils.trim_emoji(v) if v else v for v in val]
+        elif self.kind == 'case':
+            val = self._case_value(elements, selected, scanned)
+        if self.filters:
+            val = self.filters(val)
+        if not val and 'default_value' in rule:
+            if self.default_value_template:
+                val = self.default_value_template.render(values, context, max_time=datetime.datetime.max)
+            else:
+                val = rule['default_value']
+            if val and 'default_value_format' in rule:
+                val = datetime.datetime.strptime(val, rule['default_value_format'])
+        return val
+
+
+class RulePlan:
+    """
+    一组字段规则的执行计划，选择器预先翻译为XPath，解析时直接在lxml节点上执行
+    """
+
+    def __init__(self, fields_rule: dict, trim_emoji: bool = True, projection: Optional[FrozenSet[str]] = None):
+        self.fields: List[FieldPlan] = [FieldPlan(key, fields_rule[key], trim_emoji)
+                                        for key in fields_rule] if fields_rule else []
+        if projection:
+            self.fields = self._project(self.fields, projection)
+        # remove规则会修改文档树，影响后续字段的选择结果，不能提前按列批量选择
+        self.mutable = any('remove' in f.rule for f in self.fields if f.kind in ('selector', 'selectors'))
+        # 所有case规则中的简单选择器共用一次扫描
+        simple_keys = [c[2] for f in self.fields if f.kind == 'case' for c in f.case if c[2] is not None]
+        self.case_scan = CaseScan(simple_keys) if simple_keys and not self.mutable else None
+
+    @staticmethod
+    def _project(fields: List[FieldPlan], projection: FrozenSet[str]) -> List[FieldPlan]:
+        """
+        只保留需要的字段，以及它们通过模版引用的字段
+        模版只能引用排在前面的字段，从后往前找依赖即可
+        """
+        needed = set(projection)
+        kept = []
+        for i in range(len(fields) - 1, -1, -1):
+            field = fields[i]
+            # remove规则会修改文档树，后面还有字段要解析时必须保留
+            if field.key not in needed and not ('remove' in field.rule and kept):
+                continue
+            kept.append(field)
+            depends = field.depends
+            if depends is None:
+                needed.update(f.key for f in fields[:i])
+            else:
+                needed.update(depends)
+        kept.reverse()
+        return kept
+
+    def parse(self, elements: List, context=None, selected: Optional[Dict[str, object]] = None) -> dict:
+        """
+        解析一个条目的所有字段，结果与HtmlParser.parse_item_fields一致
+        :param elements: 条目对应的lxml节点
+        :param context: 模版渲染的额外上下文
+        :param selected: 按列批量预先选出的字段节点
+        :return:
+        """
+        if not elements:
+            return {}
+        values = {}
+        scanned = self.case_scan.scan(elements) if self.case_scan else None
+        for field in self.fields:
+            try:
+                val = field.evaluate(elements, values, context, selected.get(field.key) if selected else None,
+                                     scanned)
+            except Exception as e:
+                raise SiteParseFieldException(field.key, e)
+            values[field.key] = val
+        return values
+
+
+class ItemPlan:
+    """
+    条目选择器加字段规则的执行计划，用于种子列表、用户信息和详情页
+    """
+
+    def __init__(self, item_config: Optional[dict], selector_key: str, trim_emoji: bool = True,
+                 projection: Optional[FrozenSet[str]] = None):
+        item_config = item_config or {}
+        item = item_config.get(selector_key) or {}
+        self.selector = item.get('selector')
+        self.xpath = compile_selector(self.selector)
+        self.fields = RulePlan(item_config.get('fields'), trim_emoji, projection)
+        # 按列批量解析，每个字段选择器在整页上只执行一次，可在适配文件中设置batch: false关闭
+        self.batch = item.get('batch', True) and self.xpath is not None and not self.fields.mutable
+        self.columns = self._init_columns() if self.batch else {}
+
+    def _init_columns(self):
+        columns = {}
+        for field in self.fields.fields:
+            if field.kind in ('selector', 'selectors'):
+                column = compile_column_selector(field.rule[field.kind])
+                if column:
+                    columns[field.key] = column
+            elif field.kind == 'case':
+                case_columns = {}
+                for ck, _, simple, _ in field.case:
+                    if ck == '*' or (simple is not None and self.fields.case_scan):
+                        continue
+                    column = compile_column_selector(ck)
+                    if column:
+                        case_columns[ck] = column
+                if case_columns:
+                    columns[field.key] = case_columns
+        return columns
+
+    def select(self, doc: List) -> List:
+        if self.xpath is not None:
+            return select(doc, self.xpath)
+        return list(PyQuery(doc)(self.selector))
+
+    @staticmethod
+    def _column_select(doc: List, column: Tuple[etree.XPath, int], owner: Dict):
+        """
+        在整页上执行一次字段选择器，返回(所属行号, 节点)
+        选择器最左侧的元素也必须在行内，才与在该行上执行选择器的结果一致
+        """
+        xpath, depth = column
+        for node in select(doc, xpath):
+            anchor = node
+            for _ in range(depth):
+                anchor = anchor.getparent()
+            i = owner.get(anchor)
+            if i is not None:
+                yield i, node
+
+    def _select_columns(self, doc: List, rows: List) -> Optional[List[Dict[str, object]]]:
+        owner = {}
+        for i, row in enumerate(rows):
+            if row in owner:
+                # 行之间存在嵌套时无法确定匹配节点归属，退回逐行解析
+                return
+            for e in row.iter():
+                owner[e] = i
+        # 所有行同属一个父节点时（通常是表格），只需在该节点范围内执行选择器
+        parent = rows[0].getparent()
+        if parent is not None and all(row.getparent() is parent for row in rows):
+            doc = [parent]
+        elif any(e in owner for e in doc):
+            return
+        selected = [dict() for _ in rows]
+        for key, column in self.columns.items():
+            if isinstance(column, dict):
+                for s in selected:
+                    s[key] = {ck: False for ck in column}
+                for ck, c in column.items():
+                    for i, _ in self._column_select(doc, c, owner):
+                        selected[i][key][ck] = True
+            else:
+                for s in selected:
+                    s[key] = []
+                for i, node in self._column_select(doc, column, owner):
+                    selected[i][key].append(node)
+        return selected
+
+    def parse_rows(self, doc: List, context=None) -> List[dict]:
+        """
+        解析列表页的所有行，开启批量模式时每个字段选择器整页只执行一次，再按祖先节点分配回所属行
+        :param doc: 文档的lxml根节点
+        :param context: 模版渲染的额外上下文
+        :return:
+        """
+        rows = self.select(doc)
+        if not rows:
+            return []
+        selected = self._select_columns(doc, rows) if self.batch else None
+        if not selected:
+            return [self.fields.parse([row], context=context) for row in rows]
+        return [self.fields.parse([row], context=context, selected=s) for row, s in zip(rows, selected)]
+
+
+class TrimPlan:
+    """
+    页面预裁剪，按适配文件trim配置在字节层面截取需要解析的片段，只用这些片段构建文档树
+    每个片段从start标记开始，到end标记结束；未配置end时，截取到start所在标签对应的闭合标签
+    """
+
+    def __init__(self, trim_config: Optional[list], encoding: Optional[str] = None):
+        self.regions = []
+        encoding = encoding or 'utf-8'
+        for region in trim_config or []:
+            start = region.get('start')
+            if not start:
+                continue
+            end = region.get('end')
+            if end:
+                self.regions.append((start.encode(encoding), end.encode(encoding), None))
+                continue
+            match_tag = re.match(r'<([a-zA-Z][\w-]*)', start)
+            if not match_tag:
+                _LOGGER.warning(f'trim片段{start}未配置end，且不是以标签开头，忽略此片段')
+                continue
+            tag = re.compile(rb'<(/?)' + match_tag.group(1).encode(encoding) + rb'[\s/>]', re.I)
+            self.regions.append((start.encode(encoding), None, tag))
+
+    @staticmethod
+    def _find_close(content: bytes, pos: int, tag) -> int:
+        depth = 0
+        for m in tag.finditer(content, pos):
+            if m.group(1):
+                depth -= 1
+                if depth == 0:
+                    close = content.find(b'>', m.end() - 1)
+                    return close + 1 if close != -1 else -1
+            else:
+                depth += 1
+        return -1
+
+    def slice(self, content: bytes) -> Optional[bytes]:
+        """
+        截取配置的片段，按在页面中的先后顺序拼接成一个新页面
+        :param content: 响应原始字节
+        :return: 任一片段找不到时返回None，由调用方解析整页
+        """
+        if not self.regions or not content:
+            return
+        spans = []
+        for start, end, tag in self.regions:
+            begin = content.find(start)
+            if begin == -1:
+                return
+            if end:
+                stop = content.find(end, begin + len(start))
+                if stop != -1:
+                    stop += len(end)
+            else:
+                stop = self._find_close(content, begin, tag)
+            if stop == -1:
+                return
+            spans.append((begin, stop))
+        spans.sort()
+        fragments = []
+        last = 0
+        for begin, stop in spans:
+            if begin < last:
+                # 片段被前一个片段包含，不重复截取
+                continue
+            fragments.append(content[begin:stop])
+            last = stop
+        return b'<html><body>' + b''.join(fragments) + b'</body></html>'
+
+
+def parse_html(content: bytes, encoding: Optional[str] = None, trim: Optional[TrimPlan] = None):
+    """
+    按站点编码把原始字节直接交给lxml解析，不再先解码成字符串
+    :param content: 响应原始字节
+    :param encoding: 站点编码
+    :param trim: 页面预裁剪计划，只解析截取出的片段，截取失败时解析整页
+    :return: 文档的lxml根节点
+    """
+    if not content or not content.strip():
+        return
+    if trim:
+        content = trim.slice(content) or content
+    return lxml.html.fromstring(content, parser=lxml.html.HTMLParser(encoding=encoding))
+
+
+_SITE_PLANS: Dict[str, 'SitePlan'] = {}
+
+
+def load_site_plan(site_config: dict) -> 'SitePlan':
+    """
+    SitePlan反序列化时使用，解析进程内同一份站点配置只编译一次
+    :param site_config:
+    :return:
+    """
+    key = site_config.get('id')
+    plan = _SITE_PLANS.get(key)
+    if plan is None or plan.site_config != site_config:
+        plan = SitePlan(site_config)
+        _SITE_PLANS[key] = plan
+    return plan
+
+
+class SitePlan:
+    """
+    站点适配文件的编译结果，SiteHelper初始化时生成一次，之后每次解析直接使用
+    """
+
+    def __init__(self, site_config: dict):
+        self.site_config = site_config
+        login_test = ((site_config.get('login') or {}).get('test') or {}).get('selector')
+        self.login_test = compile_selector(login_test)
+        # 选出的字段值去掉emoji表情，页面不含emoji的站点可在适配文件中设置trim_emoji: false关闭
+        trim_emoji = site_config.get('trim_emoji', True)
+        self.trim_emoji = trim_emoji
+        self.userinfo = ItemPlan(site_config.get('userinfo'), 'item', trim_emoji)
+        self.detail = ItemPlan(site_config.get('detail'), 'item', trim_emoji)
+        self.torrents = ItemPlan(site_config.get('torrents'), 'list', trim_emoji)
+        self.list = ItemPlan(site_config.get('list'), 'list', trim_emoji)
+        self.trim = TrimPlan(site_config.get('trim'), site_config.get('encoding'))
+        self._projections: Dict[Tuple[str, FrozenSet[str]], ItemPlan] = {}
+
+    def __reduce__(self):
+        # 编译出的XPath不能序列化，传给解析进程时只传站点配置，在进程内重新编译
+        return load_site_plan, (self.site_config,)
+
+    def project(self, name: str, fields: Optional[Iterable[str]] = None) -> ItemPlan:
+        """
+        获取只解析部分字段的种子列表执行计划，同一组字段只编译一次
+        :param name: torrents搜索结果或list最新种子
+        :param fields: 需要的字段，为空时解析全部字段
+        :return:
+        """
+        if not fields:
+            return getattr(self, name)
+        key = (name, frozenset(fields))
+        plan = self._projections.get(key)
+        if plan is None:
+            plan = ItemPlan(self.site_config.get(name), 'list', self.trim_emoji, key[1])
+            self._projections[key] = plan
+        return plan
+
+    def parse_html(self, content: bytes, trim: bool = False):
+        """
+        用站点编码解析页面
+        :param content: 响应原始字节
+        :param trim: 是否按适配文件的trim配置预裁剪
+        :return: 文档的lxml根节点
+        """
+        return parse_html(content, self.site_config.get('encoding'), self.trim if trim else None)
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import time
+from typing import Dict, Tuple, Callable, Awaitable, Any, Hashable
+
+
+class SingleFlight:
+    """
+    合并相同的并发调用，同一事件循环内同一个key同时只执行一次，其他调用等待并共享结果
+    可以把结果再保留一段时间，期间相同的调用直接返回
+    """
+
+    def __init__(self):
+        self._calls: Dict[Tuple[int, Hashable], asyncio.Future] = {}
+        self._results: Dict[Hashable, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable], ttl: float = 0):
+        """
+        执行或等待正在执行的相同调用
+        :param key: 相同key的调用视为同一个请求
+        :param fn: 没有进行中的调用时执行
+        :param ttl: 执行成功后结果保留的秒数，0不保留
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None and result[0] > time.monotonic():
+                return result[1]
+            task = self._calls.get(call_key)
+            if task is None:
+                # 单独的任务执行，发起调用的协程被取消时不影响其他等待的调用
+                task = asyncio.ensure_future(fn())
+                self._calls[call_key] = task
+                task.add_done_callback(lambda t: self._done(call_key, key, t, ttl))
+        return await asyncio.shield(task)
+
+    def _done(self, call_key, key, task: asyncio.Future, ttl: float):
+        with self._lock:
+            self._calls.pop(call_key, None)
+            if task.cancelled() or task.exception() is not None or ttl <= 0:
+                return
+            now = time.monotonic()
+            for k in [k for k, v in self._results.items() if v[0] <= now]:
+                del self._results[k]
+            self._results[key] = (now + ttl, task.result())
@@ -4,7 +4,8 @@ from autoptspider.site.sitehelper import SiteHelper
 
 class SiteBuilder:
     @staticmethod
-    def build(site_config, cookie=None, proxies=None, user_agent=None) -> BaseSiteHelper:
+    def build(site_config, cookie=None, proxies=None, user_agent=None, parse_executor=None,
+              response_cache=None) -> BaseSiteHelper:
         if not site_config:
             return
         if site_config.get('parser'):
@@ -12,4 +13,5 @@ class SiteBuilder:
         else:
             parser = 'NexusPHP'
         if parser == 'NexusPHP':
-            return SiteHelper(site_config.copy(), cookie, proxies=proxies, user_agent=user_agent)
+            return SiteHelper(site_config.copy(), cookie, proxies=proxies, user_agent=user_agent,
+                              parse_executor=parse_executor, response_cache=response_cache)
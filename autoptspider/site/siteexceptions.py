@@ -11,6 +11,10 @@ class LoginRequired(SiteException):
         self.site_id = site_id
         self.site_name = site_name
 
+    def __reduce__(self):
+        # 保证异常能从解析进程传回
+        return self.__class__, (self.site_id, self.site_name, *self.args)
+
 
 class RequestOverloadException(SiteException):
     stop_secs = 120
@@ -23,12 +27,18 @@ class RequestOverloadException(SiteException):
         self.site_name = site_name
         self.stop_secs = stop_secs
 
+    def __reduce__(self):
+        return self.__class__, (*self.args, self.site_id, self.site_name, self.stop_secs)
+
 
 class SiteParseFieldException(SiteException):
     def __init__(self, field_name: str, *args):
         super().__init__(*args)
         self.field_name = field_name
 
+    def __reduce__(self):
+        return self.__class__, (self.field_name, *self.args)
+
 
 class SiteParseException(SiteException):
     def __init__(self, site_id: str, site_name: str, *args):
@@ -36,6 +46,9 @@ class SiteParseException(SiteException):
         self.site_id = site_id
         self.site_name = site_name
 
+    def __reduce__(self):
+        return self.__class__, (self.site_id, self.site_name, *self.args)
+
 
 class RateLimitException(SiteException):
     pass
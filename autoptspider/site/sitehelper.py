@@ -1,30 +1,42 @@
 import asyncio
 import logging
+import os
 import random
 import re
+import tempfile
+from contextlib import asynccontextmanager
 from http.cookies import SimpleCookie
-from typing import List, Optional, Dict
+from types import MappingProxyType
+from typing import List, Optional, Dict, Union, AsyncIterator, Tuple, Mapping
 
 import aiofiles
 import httpx
 from httpx import Timeout
 from jinja2 import Template
-from pyquery import PyQuery
-from pyrate_limiter import Limiter, RequestRate, Duration
 from tenacity import retry, stop_after_delay, wait_exponential, wait_fixed, stop_after_attempt, \
     retry_if_not_exception_type
 
 from moviebotapi.site import SiteUserinfo, TorrentList, CateLevel1, TorrentDetail
 
-from autoptspider.site.basesitehelper import BaseSiteHelper
+from autoptspider.site.basesitehelper import BaseSiteHelper, BATCH_UNMATCHED
 from autoptspider.site.exceptions import LoginRequired, RequestOverloadException
+from autoptspider.site.parseexecutor import ParseExecutor, get_parse_executor, parse_page, PAGE_TORRENTS, PAGE_LIST, \
+    PAGE_DETAIL, PAGE_USERINFO
+from autoptspider.site.ratelimiter import get_rate_limiter, REQUEST, DOWNLOAD
+from autoptspider.site.responsecache import ResponseCache, CachedResponse, get_response_cache
+from autoptspider.site.responseclassifier import ResponseClassifier, ResponseKind, ResponseVerdict
+from autoptspider.site.ruleplan import SitePlan
 from autoptspider.site.siteexceptions import RateLimitException
+from autoptspider.site.singleflight import SingleFlight
 from autoptspider.site.siteparser import SiteParser
 from autoptspider.utils.numberutils import NumberUtils
-
-download_limiter = Limiter(RequestRate(1, 15 * Duration.SECOND))
+from autoptspider.utils.stringutils import StringUtils
 
 _LOGGER = logging.getLogger(__name__)
+# 下载时只读取开头这部分内容判断是种子文件还是网页
+DOWNLOAD_SNIFF_SIZE = 4096
+# 下载得到网页时最多读取的内容，用于查找提示信息
+DOWNLOAD_HTML_MAX_SIZE = 1024 * 1024
 ALL_CATE_LEVEL1 = [CateLevel1.Movie,
                    CateLevel1.TV,
                    CateLevel1.Documentary,
@@ -33,17 +45,25 @@ ALL_CATE_LEVEL1 = [CateLevel1.Movie,
                    CateLevel1.AV,
                    CateLevel1.Game,
                    CateLevel1.Other]
+# 同一进程内相同的搜索请求只发一次
+_SEARCH_FLIGHT = SingleFlight()
 
 
 class SiteHelper(BaseSiteHelper):
-    headers = {
-        'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.4844.51 Safari/537.36'}
+    headers: Mapping[str, str] = MappingProxyType({
+        'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.4844.51 Safari/537.36'})
     cookies = None
-    last_search_text: Optional[str] = None
+    last_search_content: Optional[bytes] = None
     userinfo = None
+    _client: Optional[httpx.AsyncClient] = None
+    _client_loop = None
+    _client_guard = None
+    _search_semaphore: Optional[asyncio.Semaphore] = None
+    _search_semaphore_loop = None
 
     def __init__(self, site_config, cookie_str=None, request_timeout=10.0, download_timeout=180.0, proxies=None,
-                 user_agent=None):
+                 user_agent=None, parse_executor: Union[None, str, ParseExecutor] = None,
+                 response_cache: Union[None, str, ResponseCache] = None):
         self.request_timeout = request_timeout
         self.download_timeout = download_timeout
         self.cookie_str = cookie_str
@@ -52,35 +72,150 @@ class SiteHelper(BaseSiteHelper):
         self.category_mappings = self._init_category_mappings(site_config.get('category_mappings'))
         self.search_paths = self._init_search_paths(site_config.get('search').get('paths'), self.category_mappings)
         self.search_query = self._init_search_query(site_config.get('search').get('query'))
+        # 多个关键字合并为一次OR搜索，未配置时不合并
+        self.batch_search = self._init_batch_search(site_config.get('search'))
+        # 大于1时多个搜索页面并发请求，不再在页面之间随机等待
+        self.search_concurrency = int(site_config.get('search').get('concurrency') or 1)
+        # 相同搜索请求的结果保留秒数，期间再次搜索直接使用，默认只合并同时进行的相同搜索
+        self.search_result_ttl = float(site_config.get('search').get('result_ttl') or 0)
         if proxies:
             self.proxies = proxies
         else:
             self.proxies = None
+        # 每个实例单独的基础请求头，只读，Referer等按请求叠加，多个站点在同一事件循环中运行时互不影响
+        headers = dict(SiteHelper.headers)
         if user_agent:
-            self.headers['user-agent'] = user_agent
-        self.user_agent = self.headers['user-agent']
-        self._pre_init_template(self.site_config)
+            headers['user-agent'] = user_agent
+        self.headers = MappingProxyType(headers)
+        self.user_agent = headers['user-agent']
+        self.site_plan = SitePlan(self.site_config)
+        # 识别水墙、负载过高、请求过多等特殊页面，标记可以在适配文件response_markers中修改
+        self.response_classifier = ResponseClassifier(site_config.get('response_markers'), self.get_encoding())
+        # 页面解析方式：inline当前协程、thread线程池、process进程池，未指定时读取适配文件的parse_executor
+        self.parse_executor = get_parse_executor(parse_executor or site_config.get('parse_executor'))
+        self.http2, self.limits = self._init_http_config(site_config.get('http'))
+        # 按站点自适应限速，同一进程内同一站点的SiteHelper共用
+        rate_config = site_config.get('rate_limit') or {}
+        self.request_limiter = get_rate_limiter(self.get_id(), REQUEST, rate_config.get(REQUEST))
+        self.download_limiter = get_rate_limiter(self.get_id(), DOWNLOAD, rate_config.get(DOWNLOAD))
+        # 用户信息、详情、最新种子页的缓存秒数，读取适配文件cache，未配置的页面不缓存
+        cache_config = site_config.get('cache') or {}
+        self.cache_ttls = {page: float(cache_config[page]) for page in (PAGE_USERINFO, PAGE_DETAIL, PAGE_LIST) if
+                           cache_config.get(page) is not None}
+        # 缓存方式：memory进程内缓存，或磁盘缓存目录，未指定时读取适配文件cache.backend，默认memory
+        self.response_cache = get_response_cache(
+            response_cache or ((cache_config.get('backend') or 'memory') if self.cache_ttls else None))
 
-    @staticmethod
-    def _pre_init_template(site_config):
-        if not site_config:
-            return
-        SiteHelper._pre_init_template_by_fields(site_config.get('torrents', {}).get('fields'))
-        SiteHelper._pre_init_template_by_fields(site_config.get('list', {}).get('fields'))
+    def _init_http_config(self, http_config: Optional[dict]):
+        http_config = http_config or {}
+        http2 = bool(http_config.get('http2', False))
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                _LOGGER.warning(f'{self.get_name()}配置了http2，但没有安装h2，使用HTTP/1.1访问')
+                http2 = False
+        limits = httpx.Limits(
+            max_connections=http_config.get('max_connections', 10),
+            max_keepalive_connections=http_config.get('max_keepalive_connections', 5),
+            keepalive_expiry=http_config.get('keepalive_expiry', 30)
+        )
+        return http2, limits
+
+    def _build_headers(self, overlay: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """
+        基础请求头叠加本次请求的请求头
+        :param overlay: 本次请求额外的请求头
+        :return: 新的字典，调用方可以随意修改
+        """
+        headers = dict(self.headers)
+        if overlay:
+            headers.update(overlay)
+        return headers
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        获取站点共用的连接池客户端，连接在请求之间复用，事件循环变化时重新创建
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            old_client, old_loop = self._client, self._client_loop
+            if old_client is not None and not old_client.is_closed and old_loop is not None \
+                    and old_loop.is_running():
+                # 其他线程中仍在运行的事件循环，交给它关闭旧的连接池
+                asyncio.run_coroutine_threadsafe(old_client.aclose(), old_loop)
+            self._client = httpx.AsyncClient(
+                headers=self._build_headers(),
+                cookies=self.cookies,
+                http2=self.http2,
+                limits=self.limits,
+                timeout=Timeout(timeout=self.request_timeout),
+                proxies=self.proxies,
+                follow_redirects=True,
+                verify=False
+            )
+            self._client_loop = loop
+            self._client_guard = self._guard_client(self._client)
+            asyncio.ensure_future(self._client_guard.__anext__())
+        return self._client
 
     @staticmethod
-    def _pre_init_template_by_fields(fields):
-        if not fields:
-            return
-        if fields:
-            for key in fields:
-                rule = fields[key]
-                if 'text' in rule:
-                    if isinstance(rule['text'], str) and rule['text'].find('{') != -1:
-                        rule['_template'] = Template(rule['text'])
-                if 'default_value' in rule:
-                    if isinstance(rule['default_value'], str) and rule['default_value'].find('{') != -1:
-                        rule['_default_value_template'] = Template(rule['default_value'])
+    async def _guard_client(client: httpx.AsyncClient):
+        """
+        随事件循环存活的异步生成器，asyncio.run等在关闭事件循环前会关闭所有异步生成器，借此关闭连接池
+        否则每次asyncio.run调用后留下的客户端和keep-alive连接都不会关闭
+        """
+        try:
+            yield
+        finally:
+            if not client.is_closed:
+                await client.aclose()
+
+    async def _request(self, method: str, url: str, kind: str = REQUEST, **kwargs) -> httpx.Response:
+        """
+        经过站点限速器后发出请求
+        :param method:
+        :param url:
+        :param kind: request普通请求，download下载种子
+        :param kwargs: 传给httpx的其他参数
+        :return:
+        """
+        limiter = self.download_limiter if kind == DOWNLOAD else self.request_limiter
+        await limiter.acquire()
+        return await self._get_client().request(method, url, **kwargs)
+
+    @asynccontextmanager
+    async def _stream(self, method: str, url: str, kind: str = REQUEST, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        经过站点限速器后发出流式请求，响应内容需要在上下文内读取
+        """
+        limiter = self.download_limiter if kind == DOWNLOAD else self.request_limiter
+        await limiter.acquire()
+        async with self._get_client().stream(method, url, **kwargs) as r:
+            yield r
+
+    async def aclose(self):
+        """
+        关闭连接池，不再使用此站点时调用
+        :return:
+        """
+        client = self._client
+        self._client = None
+        self._client_loop = None
+        self._client_guard = None
+        if client is not None and not client.is_closed:
+            await client.aclose()
+
+    def reset_last_page(self):
+        self.last_search_content = None
+        self.userinfo = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
 
     def set_cookie(self, cookie_str: str):
         if not cookie_str:
@@ -90,6 +225,8 @@ class SiteHelper(BaseSiteHelper):
         for key, morsel in cookie.items():
             cookies[key] = morsel.value
         self.cookies = cookies
+        if self._client is not None:
+            self._client.cookies = cookies
 
     def _update_cookies(self, r):
         if not r or not self.cookies:
@@ -100,8 +237,9 @@ class SiteHelper(BaseSiteHelper):
 
     def _render_querystring(self, query):
         qs = ''
-        for key in self.search_query:
-            val = self.search_query[key]
+        search_query = self.batch_search['query'] if query.get('batch') else self.search_query
+        for key in search_query:
+            val = search_query[key]
             if isinstance(val, Template):
                 val = val.render({'query': query})
             if key == '$raw' and val is not None and val != '':
@@ -143,60 +281,132 @@ class SiteHelper(BaseSiteHelper):
         query_tmpl = {}
         for key in query_config:
             val = query_config[key]
-            if isinstance(val, str) and val.find('{') != -1:
-                query_tmpl[key] = Template(val)
-            else:
-                query_tmpl[key] = val
+            tmpl = StringUtils.get_template(val)
+            query_tmpl[key] = tmpl if tmpl else val
         return query_tmpl
 
-    async def _pass_cloudflare(self, res):
-        text = res.text
-        if text.find('data-cf-settings') != -1 and text.find('rocket-loader') != -1:
-            # 基本的水墙，解析js后再跳转访问即可
-            match_js_var = re.search(r'window.location=(.+);', res.text)
-            if match_js_var:
-                check_uri = eval(match_js_var.group(1))
-                async with httpx.AsyncClient(
-                        headers=self.headers,
-                        cookies=self.cookies,
-                        follow_redirects=True,
-                        timeout=Timeout(timeout=self.request_timeout),
-                        proxies=self.proxies,
-                        verify=False
-                ) as client:
-                    return await client.get(self.get_domain() + check_uri)
-        elif res.status_code == 503 and text.find('<title>Just a moment...</title>') != -1:
+    @classmethod
+    def _init_batch_search(cls, search_config) -> Optional[Dict]:
+        batch_config = search_config.get('batch')
+        if not batch_config:
+            return
+        query_config = dict(search_config.get('query'))
+        query_config.update(batch_config.get('query') or {})
+        return {
+            'max_keywords': int(batch_config.get('max_keywords') or 3),
+            'separator': batch_config.get('separator') or ' ',
+            # 能合并搜索的关键字，默认只合并不含空格和符号的单个词，避免OR搜索拆开多词关键字
+            'keyword_pattern': re.compile(batch_config.get('keyword_pattern') or r'\w+'),
+            'query': cls._init_search_query(query_config)
+        }
+
+    def can_batch_keyword(self, keyword: str) -> bool:
+        if not self.batch_search or not keyword or self.batch_search['separator'] in keyword:
+            return False
+        return self.batch_search['keyword_pattern'].fullmatch(keyword) is not None
+
+    async def _pass_cloudflare(self, res, verdict: ResponseVerdict):
+        if verdict.kind == ResponseKind.CloudflareRedirect:
+            # 基本的水墙，解析js中的跳转地址后再访问即可
+            res = await self._request('GET', self.get_domain() + verdict.redirect, headers=self._build_headers())
+            return res, self.response_classifier.classify(res.status_code, res.content)
+        if verdict.kind == ResponseKind.CloudflareChallenge:
             # 高级版水墙，需要模拟浏览器登陆跳过
             _LOGGER.error(f'{self.get_name()}检测到CloudFlare 5秒盾，请浏览器访问跳过拿到新Cookie重新配置。')
             raise LoginRequired(self.get_id(), self.get_name(),
                                 f'{self.get_name()}检测到CloudFlare 5秒盾，登陆失败，请浏览器访问重新获取Cookie！')
-        return res
+        return res, verdict
 
     async def _check_and_get_response(self, res):
-        res = await self._pass_cloudflare(res)
-        text = res.text
-        if text.find('负载过高，120秒后自动刷新') != -1:
+        verdict = self.response_classifier.classify(res.status_code, res.content)
+        res, verdict = await self._pass_cloudflare(res, verdict)
+        if verdict.kind == ResponseKind.Overload:
+            self.request_limiter.on_overload(120)
             raise RequestOverloadException('负载过高，120秒后自动刷新', self.get_id(), self.get_name(), 120)
+        if verdict.kind == ResponseKind.RateLimited:
+            self.request_limiter.on_overload()
+            raise RateLimitException(f'{self.get_name()}请求频率过高：{res.url}')
+        self.request_limiter.on_success()
         self._update_cookies(res)
         return res
 
+    def _cache_key(self, url: str) -> str:
+        return ResponseCache.build_key(self.get_id(), url, self.cookie_str)
+
+    def _drop_cached_page(self, url: Optional[str]):
+        if url and self.response_cache is not None:
+            self.response_cache.delete(self._cache_key(url))
+
+    async def _get_page(self, page: str, url: str, revalidate: bool = False, **kwargs) -> bytes:
+        """
+        GET请求页面，页面配置了缓存时先查缓存
+        缓存未过期时不发请求；过期后带上ETag、Last-Modified条件请求，站点返回304时继续使用缓存内容
+        :param page: 页面类型，决定缓存秒数
+        :param url:
+        :param revalidate: 缓存未过期也向站点条件请求确认
+        :param kwargs: 传给httpx的其他参数
+        :return: 响应原始字节
+        """
+        ttl = self.cache_ttls.get(page)
+        cache = self.response_cache
+        if cache is None or ttl is None:
+            r = await self._check_and_get_response(await self._request('GET', url, **kwargs))
+            return r.content
+        key = self._cache_key(url)
+        cached = cache.get(key)
+        if cached is not None and not revalidate and cached.is_fresh(ttl):
+            cache.count('hits')
+            return cached.content
+        if cached is not None:
+            kwargs['headers'] = {**(kwargs.get('headers') or {}), **cached.validators()}
+        r = await self._request('GET', url, **kwargs)
+        if cached is not None and r.status_code == 304:
+            self.request_limiter.on_success()
+            self._update_cookies(r)
+            cache.set(key, CachedResponse(cached.content, r.headers.get('etag') or cached.etag,
+                                          r.headers.get('last-modified') or cached.last_modified))
+            cache.count('revalidated')
+            return cached.content
+        r = await self._check_and_get_response(r)
+        cache.count('misses')
+        if r.status_code == 200 and r.content:
+            cache.set(key, CachedResponse(r.content, r.headers.get('etag'), r.headers.get('last-modified')))
+        return r.content
+
     @retry(retry=retry_if_not_exception_type(LoginRequired), stop=stop_after_delay(600),
            wait=wait_exponential(multiplier=1, min=30, max=120))
-    async def get_userinfo_page_text(self):
+    async def get_userinfo_page_content(self, refresh: bool = False):
+        """
+        请求用户信息页
+        :param refresh: 不使用未过期的缓存，向站点确认最新内容
+        :return: 响应原始字节
+        """
         url = self.site_config.get('userinfo').get('path')
         if not url:
             return
-        async with httpx.AsyncClient(
-                headers=self.headers,
-                cookies=self.cookies,
-                http2=False,
-                timeout=Timeout(timeout=self.request_timeout),
-                proxies=self.proxies,
-                follow_redirects=True,
-                verify=False
-        ) as client:
-            r = await self._check_and_get_response(await client.get(url))
-            return self._get_response_text(r)
+        return await self._get_page(PAGE_USERINFO, url, revalidate=refresh, headers=self._build_headers())
+
+    async def get_userinfo_page_text(self) -> Optional[str]:
+        """
+        兼容旧接口，返回按站点编码解码并去掉emoji的用户信息页
+        """
+        return self._decode_content(await self.get_userinfo_page_content())
+
+    def _decode_content(self, content: Optional[bytes]) -> Optional[str]:
+        if not content:
+            return
+        return StringUtils.trim_emoji(str(content, self.get_encoding() or 'utf-8', errors='replace'))
+
+    @property
+    def last_search_text(self) -> Optional[str]:
+        """
+        兼容旧接口，上次搜索结果页解码后的内容
+        """
+        return self._decode_content(self.last_search_content)
+
+    @last_search_text.setter
+    def last_search_text(self, text: Optional[str]):
+        self.last_search_content = text.encode(self.get_encoding() or 'utf-8') if text else None
 
     @staticmethod
     def trans_to_userinfo(result: dict):
@@ -229,45 +439,57 @@ class SiteHelper(BaseSiteHelper):
         return user
 
     async def get_userinfo(self, refresh=False) -> SiteUserinfo:
-        if not refresh and self.last_search_text:
+        if not refresh and self.last_search_content:
             # 用上次搜索结果页内容做解析
-            text = self.last_search_text
+            parsed = await self._parse_page(self.last_search_content, PAGE_USERINFO, trim=True)
         else:
-            text = await self.get_userinfo_page_text()
-        with SiteParser(self.site_config, PyQuery(text) if text else None) as parser:
-            res = parser.parse_userinfo()
+            parsed = await self._parse_page(await self.get_userinfo_page_content(refresh), PAGE_USERINFO,
+                                            url=self.site_config.get('userinfo').get('path'))
+        if parsed:
+            res = parsed['userinfo']
+        else:
+            with SiteParser(self.site_config, plan=self.site_plan) as parser:
+                res = parser.parse_userinfo()
         self.userinfo = res
         return self.trans_to_userinfo(res)
 
-    async def list(self, timeout=None, cate_level1_list=None) -> TorrentList:
+    async def _parse_page(self, content: Optional[bytes], page: str, trim: Optional[bool] = None,
+                          fields: Optional[List[str]] = None, url: Optional[str] = None) -> Optional[dict]:
+        """
+        交给解析执行器解析页面
+        :param content: 响应原始字节
+        :param page: 页面类型
+        :param trim: 是否预裁剪页面，默认只裁剪种子列表页
+        :param fields: 种子列表只解析这些字段
+        :param url: 页面地址，解析出错时（如登录失效）清除此页面的缓存
+        :return: 页面为空时返回None
+        """
+        if not content:
+            return
+        try:
+            return await self.parse_executor.run(parse_page, self.site_plan, content, page, self.userinfo, trim,
+                                                 tuple(fields) if fields else None)
+        except Exception:
+            self._drop_cached_page(url)
+            raise
+
+    async def list(self, timeout=None, cate_level1_list=None, fields: Optional[List[str]] = None) -> TorrentList:
         if not timeout:
             timeout = self.request_timeout
         list_parser = self.site_config.get('list')
         if list_parser:
-            headers = self.headers
-            headers['Referer'] = self.get_domain()
-            async with httpx.AsyncClient(
-                    headers=headers,
-                    cookies=self.cookies,
-                    timeout=timeout,
-                    proxies=self.proxies,
-                    follow_redirects=True,
-                    verify=False
-            ) as client:
-                url = f'{self.get_domain()}{list_parser.get("path")}'
-                r = await self._check_and_get_response(await client.get(url))
-                text = self._get_response_text(r)
-                if not text:
-                    return []
-                self.last_search_text = text
-                with SiteParser(self.site_config, PyQuery(text), list_parser) as parser:
-                    if not self.userinfo:
-                        self.userinfo = parser.parse_userinfo()
-                    search_result = parser.parse_torrents(context={'userinfo': self.userinfo})
-            return search_result
+            headers = self._build_headers({'Referer': self.get_domain()})
+            url = f'{self.get_domain()}{list_parser.get("path")}'
+            content = await self._get_page(PAGE_LIST, url, headers=headers, timeout=timeout)
+            parsed = await self._parse_page(content, PAGE_LIST, fields=fields, url=url)
+            if not parsed:
+                return []
+            self.last_search_content = content
+            self.userinfo = parsed['userinfo']
+            return SiteParser.build_torrents(self.site_config, parsed['items'])
         else:
             return await self.search(cate_level1_list=cate_level1_list if cate_level1_list else ALL_CATE_LEVEL1,
-                                     timeout=timeout)
+                                     timeout=timeout, fields=fields)
 
     def _build_search_path(self, cate_level1_list: Optional[List[CateLevel1]]) -> List[Dict]:
         if not cate_level1_list:
@@ -296,14 +518,9 @@ class SiteHelper(BaseSiteHelper):
             cate_level1_list: Optional[List[CateLevel1]] = None,
             free: bool = False,
             page: Optional[int] = None,
-            timeout=None
+            timeout=None,
+            fields: Optional[List[str]] = None
     ) -> TorrentList:
-        if not self.search_paths:
-            return []
-        paths = self._build_search_path(cate_level1_list)
-        if not paths:
-            # 配置文件的分类设置有问题或者真的不存在此分类
-            return []
         query = {}
         if keyword:
             query['keyword'] = keyword
@@ -315,110 +532,258 @@ class SiteHelper(BaseSiteHelper):
             query['cates'] = []
         if page:
             query['page'] = page
-        search_result: TorrentList = []
+        return await self._search_query(query, cate_level1_list, timeout, fields)
+
+    @staticmethod
+    def _match_keyword(keyword: str, torrent) -> bool:
+        text = f'{torrent.name or ""} {torrent.subject or ""}'.lower()
+        words = re.findall(r'\w+', keyword.lower())
+        return bool(words) and all(word in text for word in words)
+
+    async def search_batch(
+            self,
+            keywords: List[str],
+            cate_level1_list: Optional[List[CateLevel1]] = None,
+            free: bool = False,
+            page: Optional[int] = None,
+            timeout=None,
+            fields: Optional[List[str]] = None
+    ) -> Dict[str, TorrentList]:
+        """
+        多个关键字合并为一次OR搜索，再在本地把结果分配给各关键字
+        只合并can_batch_keyword的关键字，其他关键字单独搜索
+        关键字的每个词都出现在种子标题或副标题中才算匹配，一条结果可以属于多个关键字
+        :param keywords:
+        :return: 关键字对应的搜索结果，不能分配给任何关键字的结果放在BATCH_UNMATCHED下
+        """
+        if not self.batch_search:
+            return await super().search_batch(keywords, cate_level1_list, free, page, timeout, fields)
+        keywords = list(dict.fromkeys(k for k in keywords if k))
+        batch = [k for k in keywords if self.can_batch_keyword(k)]
+        size = max(1, self.batch_search['max_keywords'])
+        result: Dict[str, TorrentList] = {}
+        unmatched: TorrentList = []
+        for keyword in keywords:
+            if keyword not in batch:
+                result[keyword] = await self.search(keyword, None, cate_level1_list, free, page, timeout, fields)
+        for i in range(0, len(batch), size):
+            group = batch[i:i + size]
+            if len(group) == 1:
+                result[group[0]] = await self.search(group[0], None, cate_level1_list, free, page, timeout, fields)
+                continue
+            query = {'keyword': self.batch_search['separator'].join(group), 'batch': True}
+            if free:
+                query['free'] = free
+            else:
+                query['cates'] = []
+            if page:
+                query['page'] = page
+            torrents = await self._search_query(query, cate_level1_list, timeout, fields)
+            matched = set()
+            for keyword in group:
+                result[keyword] = [t for t in torrents if self._match_keyword(keyword, t)]
+                matched.update(id(t) for t in result[keyword])
+            unmatched += [t for t in torrents if id(t) not in matched]
+        if unmatched:
+            result[BATCH_UNMATCHED] = unmatched
+        return result
+
+    async def _search_query(self, query: Dict, cate_level1_list: Optional[List[CateLevel1]], timeout,
+                            fields: Optional[List[str]] = None) -> TorrentList:
+        if not self.search_paths:
+            return []
+        paths = self._build_search_path(cate_level1_list)
+        if not paths:
+            # 配置文件的分类设置有问题或者真的不存在此分类
+            return []
         if not timeout:
             timeout = self.request_timeout
-        for i, p in enumerate(paths):
+        queries = []
+        for p in paths:
             if p.get('query_cates'):
                 query['cates'] = self._trans_search_cate_id(p.get('query_cates'))
-            uri = p.get('path')
-            qs = self._render_querystring(query)
-            headers = self.headers
-            headers['Referer'] = f'{self.get_domain()}{uri}'
-            async with httpx.AsyncClient(
-                    headers=headers,
-                    cookies=self.cookies,
-                    timeout=timeout,
-                    proxies=self.proxies,
-                    follow_redirects=True,
-                    verify=False
-            ) as client:
-                if p.get('method') == 'get':
-                    url = f'{self.get_domain()}{uri}?{qs}'
-                    r = await client.get(url)
-                else:
-                    url = f'{self.get_domain()}{uri}'
-                    r = await client.post(url, data=qs)
-                text = self._get_response_text(await self._check_and_get_response(r))
-                if not text:
-                    continue
-                self.last_search_text = text
-                with SiteParser(self.site_config, PyQuery(text)) as parser:
-                    if not self.userinfo:
-                        self.userinfo = parser.parse_userinfo()
-                    torrents = parser.parse_torrents(context={'userinfo': self.userinfo})
-                if torrents:
-                    search_result += torrents
-            if i + 1 < len(paths):
-                # 多页面搜索随机延迟
-                await asyncio.sleep(random.randint(1, 3))
+            queries.append(query.copy())
+        if self.search_concurrency > 1 and len(paths) > 1:
+            results = await self._search_paths_concurrently(paths, queries, timeout, fields)
+        else:
+            results = []
+            for i, p in enumerate(paths):
+                results.append(await self._search_path(p, queries[i], timeout, fields))
+                if i + 1 < len(paths):
+                    # 多页面搜索随机延迟
+                    await asyncio.sleep(random.randint(1, 3))
+        search_result: TorrentList = []
+        for torrents in results:
+            if torrents:
+                search_result += torrents
         return search_result
 
-    def __check_limit__(self, text, err_msg):
-        if not text:
-            return
-        if text.find('请求次数过多') != -1:
-            raise RateLimitException(f'{self.get_name()}{err_msg}')
+    async def _search_path(self, p: Dict, query: Dict, timeout, fields: Optional[List[str]] = None) -> TorrentList:
+        qs = self._render_querystring(query)
+        fields = tuple(fields) if fields else None
+        key = (self.get_id(), self.cookie_str, p.get('method'), p.get('path'), qs, fields)
+        content, parsed = await _SEARCH_FLIGHT.do(key, lambda: self._fetch_search_page(p, qs, timeout, fields),
+                                                  self.search_result_ttl)
+        if not parsed:
+            return []
+        self.last_search_content = content
+        self.userinfo = parsed['userinfo']
+        # 解析结果共享，种子对象每次重新构建，调用方修改时互不影响
+        return SiteParser.build_torrents(self.site_config, parsed['items'])
+
+    async def _fetch_search_page(self, p: Dict, qs: str, timeout, fields: Optional[Tuple[str, ...]] = None):
+        """
+        请求并解析一个搜索页面
+        :return: 响应原始字节和解析结果
+        """
+        uri = p.get('path')
+        headers = self._build_headers({'Referer': f'{self.get_domain()}{uri}'})
+        if p.get('method') == 'get':
+            url = f'{self.get_domain()}{uri}?{qs}'
+            r = await self._request('GET', url, headers=headers, timeout=timeout)
+        else:
+            url = f'{self.get_domain()}{uri}'
+            r = await self._request('POST', url, data=qs, headers=headers, timeout=timeout)
+        r = await self._check_and_get_response(r)
+        return r.content, await self._parse_page(r.content, PAGE_TORRENTS, fields=fields)
+
+    def _get_search_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._search_semaphore is None or self._search_semaphore_loop is not loop:
+            self._search_semaphore = asyncio.Semaphore(self.search_concurrency)
+            self._search_semaphore_loop = loop
+        return self._search_semaphore
+
+    async def _search_paths_concurrently(self, paths: List[Dict], queries: List[Dict], timeout,
+                                         fields: Optional[List[str]] = None) -> List[TorrentList]:
+        """
+        并发请求多个搜索页面，同一站点同时进行的请求数不超过适配文件search.concurrency
+        结果按页面顺序返回，任一页面出错时取消其他页面并抛出异常
+        """
+        semaphore = self._get_search_semaphore()
+
+        async def search_path(p, q):
+            async with semaphore:
+                return await self._search_path(p, q, timeout, fields)
+
+        tasks = [asyncio.ensure_future(search_path(p, queries[i])) for i, p in enumerate(paths)]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
 
     @retry(wait=wait_fixed(3), stop=stop_after_attempt(3))
     async def get_detail(self, url) -> Optional[TorrentDetail]:
+        return await self.get_detail_once(url)
+
+    async def get_detail_once(self, url) -> Optional[TorrentDetail]:
         detail_config = self.site_config.get('detail')
         if not detail_config:
             return
-        async with httpx.AsyncClient(
-                headers=self.headers,
-                cookies=self.cookies,
-                timeout=Timeout(timeout=self.download_timeout),
-                proxies=self.proxies,
-                follow_redirects=True,
-                verify=False
-        ) as client:
-            r = await self._check_and_get_response(await client.get(url))
-            text = self._get_response_text(r)
-            if not text:
-                return
-            with SiteParser(self.site_config, PyQuery(text)) as parser:
-                detail_result = parser.parse_detail()
-            return TorrentDetail.build(self.site_config, detail_result)
+        content = await self._get_page(PAGE_DETAIL, url, headers=self._build_headers(),
+                                       timeout=Timeout(timeout=self.download_timeout))
+        parsed = await self._parse_page(content, PAGE_DETAIL, url=url)
+        if not parsed:
+            return
+        return TorrentDetail.build(self.site_config, parsed['detail'])
+
+    @staticmethod
+    async def _read_head(chunks: AsyncIterator[bytes]) -> bytes:
+        head = b''
+        async for chunk in chunks:
+            head += chunk
+            if len(head) >= DOWNLOAD_SNIFF_SIZE:
+                break
+        return head
+
+    @staticmethod
+    def _is_html(r: httpx.Response, head: bytes) -> bool:
+        if r.headers.get('content-type', '').find('text/html') != -1:
+            return True
+        # 种子文件是bencode编码的字典，以d开头
+        return not head.startswith(b'd') and head.lstrip()[:1] == b'<'
+
+    @staticmethod
+    async def _read_html(head: bytes, chunks: AsyncIterator[bytes]) -> bytes:
+        body = head
+        if len(body) < DOWNLOAD_HTML_MAX_SIZE:
+            async for chunk in chunks:
+                body += chunk
+                if len(body) >= DOWNLOAD_HTML_MAX_SIZE:
+                    break
+        return body
+
+    @staticmethod
+    async def _write_file(filepath: str, head: bytes, chunks: AsyncIterator[bytes]):
+        """
+        边下载边写入同目录的临时文件，完成后再改名，不会留下写了一半的种子文件
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filepath)), suffix='.tmp')
+        os.close(fd)
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as file:
+                await file.write(head)
+                async for chunk in chunks:
+                    await file.write(chunk)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
     @retry(stop=stop_after_delay(300), wait=wait_exponential(multiplier=1, min=30, max=120), reraise=True)
     async def download(self, url, filepath):
-        async with download_limiter.ratelimit(self.get_id(), delay=True):
-            async with httpx.AsyncClient(
-                    headers=self.headers,
-                    cookies=self.cookies,
-                    timeout=Timeout(timeout=self.download_timeout),
-                    proxies=self.proxies,
-                    follow_redirects=True,
-                    verify=False
-            ) as client:
-                if self.get_download_method() == 'POST':
-                    if self.get_download_content_type():
-                        headers = self.headers
-                        headers['content-type'] = self.get_download_content_type()
-                        r = await client.post(url, data=self.get_download_args(), headers=headers)
-                    else:
-                        r = await client.post(url, data=self.get_download_args())
-                else:
-                    r = await client.get(url)
-                if r.status_code == 404:
-                    return
-                if 'content-type' in r.headers and r.headers['content-type'].find('text/html') != -1:
-                    if r.text.find(
-                            '下载提示') != -1 or r.text.find('下載輔助說明') != -1:
-                        match_id = re.search(r'name="id"\s+value="(\d+)"', r.text)
-                        if match_id:
-                            r = await client.post(f'{self.get_domain()}downloadnotice.php',
-                                                  data={'id': match_id.group(1), 'type': 'ratio'})
-                        else:
-                            raise RuntimeError(
-                                '%s下载种子需要页面确认，先手动打开浏览器下载一次，并重新换Cookie！' % self.get_name())
-                    else:
-                        self.__check_limit__(r.text, '下载频率过高：%s' % url)
-                        logging.error(f'下载种子错误：%s' % url)
-                        logging.error('%s' % r.text)
-                        raise RuntimeError(f'{self.get_name()}下载出错')
+        return await self.download_once(url, filepath)
+
+    async def download_once(self, url, filepath):
+        """
+        下载一个种子，出错时不重试
+        :param url:
+        :param filepath:
+        :return: 是否下载到了种子，站点返回404时为False
+        """
+        timeout = Timeout(timeout=self.download_timeout)
+        if self.get_download_method() == 'POST':
+            headers = self._build_headers()
+            if self.get_download_content_type():
+                headers['content-type'] = self.get_download_content_type()
+            request = {'method': 'POST', 'data': self.get_download_args(), 'headers': headers}
+        else:
+            request = {'method': 'GET', 'headers': self._build_headers()}
+        async with self._stream(url=url, kind=DOWNLOAD, timeout=timeout, **request) as r:
+            if r.status_code == 404:
+                return False
+            chunks = r.aiter_bytes()
+            head = await self._read_head(chunks)
+            if not self._is_html(r, head):
+                await self._write_file(filepath, head, chunks)
+                self.download_limiter.on_success()
+                return True
+            status_code = r.status_code
+            body = await self._read_html(head, chunks)
+        verdict = self.response_classifier.classify(status_code, body)
+        if verdict.kind == ResponseKind.DownloadNotice:
+            match_id = re.search(rb'name="id"\s+value="(\d+)"', body)
+            if not match_id:
+                raise RuntimeError(
+                    '%s下载种子需要页面确认，先手动打开浏览器下载一次，并重新换Cookie！' % self.get_name())
+            async with self._stream('POST', f'{self.get_domain()}downloadnotice.php',
+                                    data={'id': match_id.group(1).decode(), 'type': 'ratio'},
+                                    headers=self._build_headers(), timeout=timeout) as r:
                 if r.status_code == 404:
-                    return
-                async with aiofiles.open(filepath, 'wb') as file:
-                    await file.write(r.content)
+                    return False
+                chunks = r.aiter_bytes()
+                await self._write_file(filepath, await self._read_head(chunks), chunks)
+            self.download_limiter.on_success()
+            return True
+        if verdict.kind == ResponseKind.RateLimited:
+            self.download_limiter.on_overload()
+            raise RateLimitException(f'{self.get_name()}下载频率过高：{url}')
+        if verdict.kind == ResponseKind.Overload:
+            self.download_limiter.on_overload(120)
+            raise RequestOverloadException('负载过高，120秒后自动刷新', self.get_id(), self.get_name(), 120)
+        logging.error(f'下载种子错误：%s' % url)
+        logging.error('%s' % body.decode(self.get_encoding() or 'utf-8', errors='replace'))
+        raise RuntimeError(f'{self.get_name()}下载出错')
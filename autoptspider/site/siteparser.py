@@ -1,4 +1,5 @@
 import logging
+from typing import Optional, List
 
 from cssselect import SelectorSyntaxError
 from pyquery import PyQuery
@@ -6,19 +7,28 @@ from pyquery import PyQuery
 from moviebotapi.site import TorrentList, Torrent
 
 from autoptspider.site.htmlparser import HtmlParser
+from autoptspider.site.ruleplan import SitePlan, ItemPlan, select
 from autoptspider.site.siteexceptions import SiteParseException, LoginRequired
 
 _LOGGER = logging.getLogger(__name__)
 
 
 class SiteParser:
-    def __init__(self, site_config, doc: PyQuery = None, torrents_rule=None):
+    def __init__(self, site_config, doc: PyQuery = None, torrents_rule=None, plan: Optional[SitePlan] = None,
+                 torrents_plan: Optional[ItemPlan] = None):
         self.site_config = site_config
         if torrents_rule:
             self.torrents_rule = torrents_rule
         else:
             self.torrents_rule = self.site_config.get('torrents')
         self.doc = doc
+        self.plan = plan
+        if torrents_plan:
+            self.torrents_plan = torrents_plan
+        elif plan:
+            self.torrents_plan = plan.torrents
+        else:
+            self.torrents_plan = None
 
     def test_login(self):
         login_config = self.site_config.get('login')
@@ -31,6 +41,8 @@ class SiteParser:
             return False
         test = login_config.get('test')
         try:
+            if self.plan and self.plan.login_test is not None:
+                return bool(select(self.doc, self.plan.login_test))
             if self.doc(test.get('selector')):
                 return True
             else:
@@ -56,6 +68,8 @@ class SiteParser:
         if constant:
             return user_rule.get('fields')
         try:
+            if self.plan:
+                return self.plan.userinfo.fields.parse(self.plan.userinfo.select(self.doc))
             item_tag = self.doc(user_rule.get('item')['selector'])
             result = HtmlParser.parse_item_fields(item_tag, field_rule)
             return result
@@ -77,6 +91,8 @@ class SiteParser:
         if not field_rule:
             return
         try:
+            if self.plan:
+                return self.plan.detail.fields.parse(self.plan.detail.select(self.doc))
             item_tag = self.doc(detail_config.get('item')['selector'])
             result = HtmlParser.parse_item_fields(item_tag, field_rule)
             return result
@@ -88,6 +104,14 @@ class SiteParser:
                                      f"{self.site_config.get('name')}种子详情页解析失败")
 
     def parse_torrents(self, context=None) -> TorrentList:
+        return self.build_torrents(self.site_config, self.parse_torrent_items(context))
+
+    def parse_torrent_items(self, context=None) -> List[dict]:
+        """
+        解析种子列表的原始字段值，不转换为Torrent，结果可以跨进程传递
+        :param context:
+        :return:
+        """
         if not self.torrents_rule:
             return []
         list_rule = self.torrents_rule.get('list')
@@ -95,14 +119,15 @@ class SiteParser:
         if not fields_rule:
             return []
         try:
+            if self.torrents_plan:
+                return self.torrents_plan.parse_rows(self.doc, context=context)
             rows = self.doc(list_rule['selector'])
             if not rows:
                 return []
-            result: TorrentList = []
+            result = []
             for i in range(rows.length):
                 tag = rows.eq(i)
-                item = HtmlParser.parse_item_fields(tag, fields_rule, context=context)
-                result.append(Torrent.build_by_parse_item(self.site_config, item))
+                result.append(HtmlParser.parse_item_fields(tag, fields_rule, context=context))
             return result
         except SelectorSyntaxError as e:
             raise SiteParseException(self.site_config.get('id'), self.site_config.get('name'),
@@ -111,6 +136,14 @@ class SiteParser:
             raise SiteParseException(self.site_config.get('id'), self.site_config.get('name'),
                                      f"{self.site_config.get('name')}种子信息解析失败")
 
+    @staticmethod
+    def build_torrents(site_config, items: List[dict]) -> TorrentList:
+        try:
+            return [Torrent.build_by_parse_item(site_config, item) for item in items]
+        except Exception as e:
+            raise SiteParseException(site_config.get('id'), site_config.get('name'),
+                                     f"{site_config.get('name')}种子信息解析失败")
+
     def __enter__(self):
         return self
 
@@ -1,12 +1,19 @@
 import asyncio
+import atexit
+import itertools
 import logging
+import os
+import queue
+import threading
 import time
 from enum import Enum
 from multiprocessing import Queue, Process
-from typing import Union, List, Dict, Optional
+from typing import Union, List, Dict, Optional, Iterator
 
 from httpcore import TimeoutException
-from tenacity import stop_after_delay, wait_exponential, retry_if_not_exception_type, AsyncRetrying
+from tenacity import stop_after_delay, wait_exponential, retry_if_not_exception_type, AsyncRetrying, RetryError
+from tenacity.stop import stop_base
+from tenacity.wait import wait_base
 
 from moviebotapi.site import SiteUserinfo
 
@@ -15,6 +22,35 @@ from autoptspider.site.exceptions import RequestOverloadException, LoginRequired
 from autoptspider.site.sitebuilder import SiteBuilder
 
 _LOGGER = logging.getLogger(__name__)
+# 设置了截止时间的任务，超过截止时间这么久仍没有收到AllFinished时不再等待
+RESULT_GRACE_SECS = 5
+# 自动翻页最多翻到的页码，第一页为0
+MAX_PAGE = 10
+
+
+class _stop_at_deadline(stop_base):
+    """
+    到达截止时间后不再重试
+    """
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+
+    def __call__(self, retry_state) -> bool:
+        return time.monotonic() >= self.deadline
+
+
+class _wait_until_deadline(wait_base):
+    """
+    重试等待时间不超过截止时间
+    """
+
+    def __init__(self, wait: wait_base, deadline: float):
+        self.wait = wait
+        self.deadline = deadline
+
+    def __call__(self, retry_state) -> float:
+        return max(0.0, min(self.wait(retry_state), self.deadline - time.monotonic()))
 
 
 class SiteSearcher:
@@ -29,8 +65,15 @@ class SiteSearcher:
                  timeout: int = None,
                  search_value_type: Union[None, List] = None,
                  all_pages: bool = False,
-                 error_waiting_time: int = 600
+                 error_waiting_time: int = 600,
+                 fields: Optional[List[str]] = None,
+                 deadline: Optional[float] = None,
+                 max_results: Optional[int] = None
                  ):
+        """
+        :param deadline: 截止时间，time.monotonic()的值；到达后不再翻页、换关键字或重试，已有结果按超时返回
+        :param max_results: 每个关键字最多返回的结果数，自动翻页时达到后停止翻页
+        """
         self.site_helper = site_helper
         self.querys = []
         if query:
@@ -43,6 +86,16 @@ class SiteSearcher:
         self.timeout = timeout
         self.all_pages = all_pages
         self.cur_page = 0
+        # 种子只解析这些字段，为空时解析全部字段
+        self.fields = fields
+        self.deadline = deadline
+        self.timed_out = False
+        # 搜索过程中已经得到的结果，到达截止时间被取消时按超时返回
+        self.partial: Optional[list] = None
+        self.max_results = max_results
+        # 站点每页的结果数，返回的结果少于此数时视为最后一页，未配置时以第一页为准
+        search_config = (site_helper.site_config or {}).get('search') or {}
+        self.page_size = int(search_config.get('page_size') or 0)
         if not error_waiting_time:
             self.error_waiting_time = 600
         else:
@@ -63,14 +116,148 @@ class SiteSearcher:
     def get_query_str(self):
         return [i.get('value') for i in self.querys]
 
+    def _remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return
+        return self.deadline - time.monotonic()
+
+    def _deadline_reached(self) -> bool:
+        remaining = self._remaining()
+        # 事件循环的定时器可能比截止时间早一个时钟精度触发
+        return remaining is not None and remaining <= 0.01
+
+    async def _sleep(self, secs: float) -> bool:
+        """
+        等待一段时间，会超过截止时间时不等待
+        :param secs:
+        :return: 是否等待了
+        """
+        remaining = self._remaining()
+        if remaining is not None and remaining <= secs:
+            return False
+        await asyncio.sleep(secs)
+        return True
+
+    def _get_timeout(self, timeout=None):
+        """
+        单个请求的超时时间，不超过截止时间
+        :param timeout: 未指定时使用搜索配置的超时时间
+        :return:
+        """
+        timeout = timeout or self.timeout
+        remaining = self._remaining()
+        if remaining is None:
+            return timeout
+        timeout = timeout or getattr(self.site_helper, 'request_timeout', None) or remaining
+        return max(0.1, min(timeout, remaining))
+
+    async def _call(self, coro):
+        """
+        调用站点方法，设置了截止时间时到达后取消，站点内部的重试、限速等待都不会超过截止时间
+        :param coro:
+        :return:
+        """
+        remaining = self._remaining()
+        if remaining is None:
+            return await coro
+        if remaining <= 0:
+            coro.close()
+            raise TimeoutException(f'{self.get_site_name()}到达截止时间')
+        try:
+            return await asyncio.wait_for(coro, remaining)
+        except asyncio.TimeoutError:
+            raise TimeoutException(f'{self.get_site_name()}到达截止时间')
+
+    def _retrying(self, stop_secs: float, min_wait: float) -> AsyncRetrying:
+        stop = stop_after_delay(stop_secs)
+        wait = wait_exponential(multiplier=1, min=min_wait, max=120)
+        if self.deadline is not None:
+            stop = stop | _stop_at_deadline(self.deadline)
+            wait = _wait_until_deadline(wait, self.deadline)
+        # 到达截止时间被取消的任务不能重试，否则取消会变成RetryError
+        return AsyncRetrying(retry=retry_if_not_exception_type((LoginRequired, asyncio.CancelledError)), stop=stop,
+                             wait=wait)
+
+    def _deadline_timeout(self, e: RetryError):
+        """
+        重试因到达截止时间停止时，返回超时异常，否则原样返回
+        :param e:
+        :return:
+        """
+        if not self._deadline_reached():
+            return e
+        return TimeoutException(f'{self.get_site_name()}到达截止时间，停止重试：{repr(e.last_attempt.exception())}')
+
+    def _batch_querys(self) -> List[dict]:
+        """
+        站点配置了合并搜索且不自动翻页时，能合并的关键字查询合并为一次搜索，其他查询不变
+        :return:
+        """
+        if self.all_pages or not self.site_helper.batch_search:
+            return self.querys
+        keywords = [q for q in self.querys if
+                    q.get('key') == 'keyword' and self.site_helper.can_batch_keyword(q.get('value'))]
+        if len(keywords) < 2:
+            return self.querys
+        querys = []
+        for q in self.querys:
+            if q is keywords[0]:
+                querys.append({'key': 'keywords', 'value': [k.get('value') for k in keywords]})
+            elif not any(q is k for k in keywords):
+                querys.append(q)
+        return querys
+
+    async def _search_batch(self, params: dict):
+        """
+        合并搜索的全部结果，包括不能分配给关键字的结果，按id去重
+        """
+        r = await self._call(self.site_helper.search_batch(**params))
+        res = []
+        ids = set()
+        for torrents in r.values():
+            for t in torrents:
+                if t.id not in ids:
+                    ids.add(t.id)
+                    res.append(t)
+        return res
+
+    def _fetch_page(self, params: dict, page: int) -> asyncio.Future:
+        if page:
+            params = {**params, 'page': page}
+        if 'keywords' in params:
+            return asyncio.ensure_future(self._search_batch(params))
+        return asyncio.ensure_future(self._call(self.site_helper.search(**params)))
+
     async def _search(self, q, params):
+        """
+        搜索一个关键字，自动翻页时在等待当前页的同时预先请求下一页，请求间隔由站点限速控制
+        出现重复内容、不足一页、达到max_results或超过10页时停止翻页
+        """
         res = []
         ids = set()
-        while True:
-            try:
-                if self.cur_page:
-                    params.update({'page': self.cur_page})
-                r = await self.site_helper.search(**params)
+        page_size = self.page_size
+        current = self._fetch_page(params, self.cur_page)
+        prefetch = None
+        try:
+            while True:
+                if self.all_pages and self.cur_page < MAX_PAGE:
+                    remaining = self._remaining()
+                    if remaining is None or remaining > 0:
+                        prefetch = self._fetch_page(params, self.cur_page + 1)
+                try:
+                    r = await current
+                except RequestOverloadException as e:
+                    await self._sleep(e.stop_secs)
+                    raise e
+                except TimeoutException as e:
+                    if not self.all_pages or not res or not self._deadline_reached():
+                        raise e
+                    # 翻页时到达截止时间，返回已经得到的页
+                    current = None
+                    _LOGGER.info(f"{self.get_site_name()}搜索{q.get('value')} 到达截止时间，停止自动翻页")
+                    self.timed_out = True
+                    break
+                current, prefetch = prefetch, None
                 if not self.all_pages:
                     res = r
                     break
@@ -83,47 +270,81 @@ class SiteSearcher:
                     break
                 self.cur_page += 1
                 res += r
-                if self.cur_page > 10:
-                    _LOGGER.info(f"{self.get_site_name()}搜索{q.get('value')} 搜索结果超过10页，停止自动翻页")
-                    break
                 for t in r:
                     ids.add(t.id)
-                await asyncio.sleep(1)
-            except RequestOverloadException as e:
-                await asyncio.sleep(e.stop_secs)
-                raise e
+                if self.max_results and len(res) >= self.max_results:
+                    break
+                # 未配置每页数量时以第一页的数量为准
+                page_size = page_size or len(r)
+                if len(r) < page_size:
+                    break
+                if self.cur_page > MAX_PAGE:
+                    _LOGGER.info(f"{self.get_site_name()}搜索{q.get('value')} 搜索结果超过10页，停止自动翻页")
+                    break
+                if current is None:
+                    _LOGGER.info(f"{self.get_site_name()}搜索{q.get('value')} 到达截止时间，停止自动翻页")
+                    self.timed_out = True
+                    break
+        finally:
+            for task in (current, prefetch):
+                if task is None:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # 停止翻页后不再需要的预取结果，取出异常避免警告
+                    task.exception()
+        if self.max_results and res:
+            res = res[:self.max_results]
         return res
 
     async def search(self):
         start = time.perf_counter()
+        self.timed_out = False
         try:
             ids: set = set()
             res = []
-            for i, q in enumerate(self.querys):
+            self.partial = res
+            querys = self._batch_querys()
+            for i, q in enumerate(querys):
+                # 每个关键字从第一页开始翻页，网络错误重试时从出错的页继续
+                self.cur_page = 0
                 params = {
                     q.get('key'): q.get('value'),
                     'cate_level1_list': self.cate_level1_list,
-                    'timeout': self.timeout
+                    'timeout': self._get_timeout()
                 }
-                if self.network_error_retry:
-                    async for attempt in AsyncRetrying(retry=retry_if_not_exception_type(LoginRequired),
-                                                       stop=stop_after_delay(self.error_waiting_time),
-                                                       wait=wait_exponential(multiplier=1, min=5, max=120)):
-                        with attempt:
-                            r = await self._search(q, params)
-                else:
-                    r = await self._search(q, params)
-                if not r:
-                    continue
-                for t in r:
+                if self.fields:
+                    params['fields'] = self.fields
+                try:
+                    if self.network_error_retry:
+                        async for attempt in self._retrying(self.error_waiting_time, 5):
+                            with attempt:
+                                r = await self._search(q, params)
+                    else:
+                        r = await self._search(q, params)
+                except (RetryError, TimeoutException) as e:
+                    if not self._deadline_reached():
+                        raise e
+                    # 到达截止时间，返回已经得到的结果
+                    self.timed_out = True
+                    break
+                for t in r or []:
                     if t.id in ids:
                         continue
                     res.append(t)
                     ids.add(t.id)
-                if i + 1 < len(self.querys):
-                    await asyncio.sleep(self.interval_secs)
+                if self.timed_out:
+                    break
+                if not r:
+                    continue
+                if i + 1 < len(querys) and not await self._sleep(self.interval_secs):
+                    # 等不到下一个关键字的搜索间隔，剩下的关键字不再搜索
+                    self.timed_out = True
+                    break
             self.cur_page = 0
-            return {'code': 0, 'data': res}
+            # code为1表示到达截止时间，data为截止前已经得到的结果
+            return {'code': 1 if self.timed_out else 0, 'data': res}
         except LoginRequired as e:
             raise e
         finally:
@@ -134,20 +355,22 @@ class SiteSearcher:
         start = time.perf_counter()
         try:
             if self.network_error_retry:
-                async for attempt in AsyncRetrying(retry=retry_if_not_exception_type(LoginRequired),
-                                                   stop=stop_after_delay(600),
-                                                   wait=wait_exponential(multiplier=1, min=20, max=120)):
-                    with attempt:
-                        try:
-                            r = await self.site_helper.list(10, self.cate_level1_list)
-                        except RequestOverloadException as e:
-                            await asyncio.sleep(e.stop_secs)
-                            raise e
-                        except Exception as e:
-                            _LOGGER.info(f"{self.get_site_name()}获取最新种子列表出错，自动重试中，错误信息：{repr(e)}")
-                            raise e
+                try:
+                    async for attempt in self._retrying(600, 20):
+                        with attempt:
+                            try:
+                                r = await self._call(self.site_helper.list(self._get_timeout(10),
+                                                                           self.cate_level1_list, self.fields))
+                            except RequestOverloadException as e:
+                                await self._sleep(e.stop_secs)
+                                raise e
+                            except Exception as e:
+                                _LOGGER.info(f"{self.get_site_name()}获取最新种子列表出错，自动重试中，错误信息：{repr(e)}")
+                                raise e
+                except RetryError as e:
+                    raise self._deadline_timeout(e)
             else:
-                r = await self.site_helper.list(10, self.cate_level1_list)
+                r = await self._call(self.site_helper.list(self._get_timeout(10), self.cate_level1_list, self.fields))
             return r
         except LoginRequired as e:
             raise e
@@ -159,20 +382,21 @@ class SiteSearcher:
         start = time.perf_counter()
         try:
             if self.network_error_retry:
-                async for attempt in AsyncRetrying(retry=retry_if_not_exception_type(LoginRequired),
-                                                   stop=stop_after_delay(600),
-                                                   wait=wait_exponential(multiplier=1, min=20, max=120)):
-                    with attempt:
-                        try:
-                            r = await self.site_helper.get_userinfo(refresh)
-                        except RequestOverloadException as e:
-                            await asyncio.sleep(e.stop_secs)
-                            raise e
-                        except Exception as e:
-                            _LOGGER.info(f"{self.get_site_name()}获取最新用户信息出错，自动重试中，错误信息：{repr(e)}")
-                            raise e
+                try:
+                    async for attempt in self._retrying(600, 20):
+                        with attempt:
+                            try:
+                                r = await self._call(self.site_helper.get_userinfo(refresh))
+                            except RequestOverloadException as e:
+                                await self._sleep(e.stop_secs)
+                                raise e
+                            except Exception as e:
+                                _LOGGER.info(f"{self.get_site_name()}获取最新用户信息出错，自动重试中，错误信息：{repr(e)}")
+                                raise e
+                except RetryError as e:
+                    raise self._deadline_timeout(e)
             else:
-                r = await self.site_helper.get_userinfo(refresh)
+                r = await self._call(self.site_helper.get_userinfo(refresh))
             return r
         except LoginRequired as e:
             raise e
@@ -222,29 +446,137 @@ class SiteInvokerFunction(str, Enum):
     GetUser = '_get_user'
 
 
+class _SiteHelperCache:
+    """
+    工作进程内按站点保留的SiteHelper，配置不变时直接复用，保留已编译的解析计划和连接池
+    每个站点只保留一个，Cookie、UA等配置变化时替换；任务通过acquire、release使用，旧的SiteHelper等所有任务都释放后才关闭
+    工作进程本身已是多进程，未指定解析方式时在当前协程中解析，不再每个工作进程创建解析进程池
+    """
+
+    def __init__(self):
+        self._helpers: Dict[str, tuple] = {}
+        # 正在被任务使用的次数
+        self._users: Dict[int, int] = {}
+        # 已被新配置替换，但仍有任务在使用的SiteHelper
+        self._retired: Dict[int, BaseSiteHelper] = {}
+
+    @staticmethod
+    def _key(site: dict) -> str:
+        site_config = site.get('site_config') or {}
+        return site_config.get('id')
+
+    def get(self, site: dict) -> Optional[BaseSiteHelper]:
+        """
+        获取站点的SiteHelper，不计入使用次数
+        :param site:
+        :return:
+        """
+        key = self._key(site)
+        cached = self._helpers.get(key)
+        if cached is not None and cached[0] == site:
+            return cached[1]
+        helper = SiteBuilder.build(
+            site.get('site_config'),
+            site.get('cookie'),
+            site.get('proxies'),
+            site.get('user_agent'),
+            site.get('parse_executor') or 'inline',
+            site.get('response_cache'),
+        )
+        if cached is not None and cached[1] is not None:
+            # 配置变化的站点，旧的SiteHelper没有任务使用时关闭连接池，否则等释放时再关闭
+            if self._users.get(id(cached[1])):
+                self._retired[id(cached[1])] = cached[1]
+            else:
+                asyncio.ensure_future(cached[1].aclose())
+        self._helpers[key] = (site, helper)
+        return helper
+
+    def acquire(self, site: dict) -> Optional[BaseSiteHelper]:
+        """
+        获取站点的SiteHelper并计入使用次数，用完后调用release
+        :param site:
+        :return:
+        """
+        helper = self.get(site)
+        if helper is not None:
+            self._users[id(helper)] = self._users.get(id(helper), 0) + 1
+        return helper
+
+    async def release(self, helper: Optional[BaseSiteHelper]):
+        """
+        任务不再使用此SiteHelper，已被替换且没有其他任务使用时关闭
+        :param helper:
+        :return:
+        """
+        if helper is None:
+            return
+        count = self._users.get(id(helper), 0) - 1
+        if count > 0:
+            self._users[id(helper)] = count
+            return
+        self._users.pop(id(helper), None)
+        retired = self._retired.pop(id(helper), None)
+        if retired is not None:
+            await retired.aclose()
+
+    async def aclose(self):
+        helpers = [h for _, h in self._helpers.values() if h] + list(self._retired.values())
+        self._helpers.clear()
+        self._retired.clear()
+        self._users.clear()
+        await asyncio.gather(*[h.aclose() for h in helpers], return_exceptions=True)
+
+
 class _MultiSearcherInvoker:
     def __init__(self, searcher_config: List[Dict], q: Queue,
-                 method: Union[SiteInvokerFunction, List[SiteInvokerFunction]]):
+                 method: Union[SiteInvokerFunction, List[SiteInvokerFunction]],
+                 site_helpers: Optional[_SiteHelperCache] = None, deadline: Optional[float] = None):
+        """
+        :param searcher_config:
+        :param q: 结果队列
+        :param method:
+        :param site_helpers: 常驻工作进程传入，复用已有的SiteHelper且执行后不关闭连接池；为空时每次新建
+            复用的SiteHelper在任务开始时清除上次搜索的页面，同一任务的多个方法共用
+        :param deadline: 所有任务的截止时间，time.time()的值；到达后取消未完成的站点并按超时返回
+        """
         self.searcher_config = searcher_config
         self.q = q
         if isinstance(method, SiteInvokerFunction):
             method = [method]
         self.method: List[SiteInvokerFunction] = method
-
-    @staticmethod
-    def _build_searcher(searcher_config) -> List[SiteSearcher]:
+        self.site_helpers = site_helpers
+        # 本次任务从site_helpers取得的SiteHelper，按站点配置的序号
+        self._job_helpers: Dict[int, BaseSiteHelper] = {}
+        self.deadline = deadline
+        # 截止时间换算成当前进程的time.monotonic()
+        self._deadline = time.monotonic() + (deadline - time.time()) if deadline is not None else None
+
+    def _build_searcher(self, searcher_config) -> List[SiteSearcher]:
         if not searcher_config:
             return []
         searchers: List[SiteSearcher] = []
-        for config in searcher_config:
+        for i, config in enumerate(searcher_config):
             site = config.get('site')
-            s = SiteSearcher(
-                SiteBuilder.build(
+            if self.site_helpers is not None:
+                site_helper = self._job_helpers.get(i)
+                if site_helper is None:
+                    site_helper = self.site_helpers.acquire(site)
+                    if site_helper is not None:
+                        # 其他任务留下的搜索页面可能已经过时，获取用户信息时不能再用
+                        site_helper.reset_last_page()
+                        self._job_helpers[i] = site_helper
+            else:
+                site_helper = SiteBuilder.build(
                     site.get('site_config'),
                     site.get('cookie'),
                     site.get('proxies'),
                     site.get('user_agent'),
-                ),
+                    site.get('parse_executor'),
+                    site.get('response_cache'),
+                )
+            s = SiteSearcher(
+                site_helper,
                 config.get('query'),
                 config.get('cate_level1_list'),
                 config.get('network_error_retry'),
@@ -252,14 +584,29 @@ class _MultiSearcherInvoker:
                 search_value_type=config.get('search_value_type'),
                 all_pages=config.get('all_pages'),
                 error_waiting_time=config.get('error_waiting_time'),
+                fields=config.get('fields'),
+                deadline=self._deadline,
+                max_results=config.get('max_results'),
             )
             searchers.append(s)
         return searchers
 
     def __call__(self):
-        for name in self.method:
-            m = getattr(self, name.value)
-            m()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self.invoke())
+
+    async def invoke(self):
+        try:
+            for name in self.method:
+                m = getattr(self, name.value)
+                await m()
+        finally:
+            if self.site_helpers is not None:
+                helpers = list(self._job_helpers.values())
+                self._job_helpers.clear()
+                for helper in helpers:
+                    await self.site_helpers.release(helper)
         self.q.put(ResultMessage(ResultType.AllFinished))
 
     @staticmethod
@@ -274,39 +621,67 @@ class _MultiSearcherInvoker:
             data=data
         )
 
-    def _process(self, searchers: Dict[object, SiteSearcher], tasks: List):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        finished, unfinished = loop.run_until_complete(asyncio.wait(tasks))
-        for task in finished:
-            searcher = searchers.get(task.get_coro())
-            try:
-                res = task.result()
-            except LoginRequired as e:
-                self.q.put(ResultMessage(ResultType.LoginError, self._build_result(searcher, e)))
-                continue
-            except TimeoutException as e:
-                self.q.put(ResultMessage(ResultType.Timeout, self._build_result(searcher, e)))
-                continue
-            except Exception as e:
-                self.q.put(ResultMessage(ResultType.Error, self._build_result(searcher, e)))
-                continue
-            if not res:
-                continue
-            if isinstance(res, dict) and res.get('code') == 1:
-                self.q.put(ResultMessage(ResultType.Timeout, self._build_result(searcher)))
-                continue
-            self.q.put(
-                ResultMessage(ResultType.Result, self._build_result(searcher,
-                                                                    data=res.get('data') if res and isinstance(res,
-                                                                                                               dict) else res)))
-
-        if unfinished:
-            for task in unfinished:
-                searcher = searchers.get(task.get_coro())
-                self.q.put(ResultMessage(ResultType.Timeout, self._build_result(searcher)))
+    def _put_result(self, searcher: SiteSearcher, task: asyncio.Future):
+        try:
+            res = task.result()
+        except LoginRequired as e:
+            self.q.put(ResultMessage(ResultType.LoginError, self._build_result(searcher, e)))
+            return
+        except TimeoutException as e:
+            self.q.put(ResultMessage(ResultType.Timeout, self._build_result(searcher, e)))
+            return
+        except Exception as e:
+            self.q.put(ResultMessage(ResultType.Error, self._build_result(searcher, e)))
+            return
+        if not res:
+            return
+        if isinstance(res, dict) and res.get('code') == 1:
+            # 到达截止时间，带上截止前已经得到的结果
+            self.q.put(ResultMessage(ResultType.Timeout, self._build_result(searcher, data=res.get('data'))))
+            return
+        self.q.put(
+            ResultMessage(ResultType.Result, self._build_result(searcher,
+                                                                data=res.get('data') if res and isinstance(res,
+                                                                                                           dict) else res)))
+
+    async def _process(self, searchers: Dict[object, SiteSearcher], tasks: List):
+        """
+        并发执行各站点任务，每个站点完成后立即放入结果，不等待最慢的站点
+        到达截止时间时取消未完成的站点，按超时返回
+        """
+        futures = {asyncio.ensure_future(t): searchers.get(t) for t in tasks}
+        pending = set(futures)
+        try:
+            while pending:
+                timeout = None
+                if self._deadline is not None:
+                    timeout = self._deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                finished, pending = await asyncio.wait(pending, timeout=timeout,
+                                                       return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    self._put_result(futures.get(task), task)
+            if pending:
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                for task in pending:
+                    if task.cancelled():
+                        searcher = futures.get(task)
+                        self.q.put(ResultMessage(ResultType.Timeout, self._build_result(searcher,
+                                                                                        data=searcher.partial)))
+                    else:
+                        self._put_result(futures.get(task), task)
+                pending = set()
+        finally:
+            for task in pending:
+                task.cancel()
+            if self.site_helpers is None:
+                await asyncio.gather(*[s.get_site_helper().aclose() for s in searchers.values()],
+                                     return_exceptions=True)
 
-    def _list(self):
+    async def _list(self):
         searcher = self._build_searcher(self.searcher_config)
         if not searcher:
             self.q.put(ResultMessage(ResultType.AllFinished))
@@ -317,9 +692,9 @@ class _MultiSearcherInvoker:
             t = s.list()
             tasks.append(t)
             searchers[t] = s
-        self._process(searchers, tasks)
+        await self._process(searchers, tasks)
 
-    def _search(self):
+    async def _search(self):
         searcher = self._build_searcher(self.searcher_config)
         if not searcher:
             self.q.put(ResultMessage(ResultType.AllFinished))
@@ -330,9 +705,9 @@ class _MultiSearcherInvoker:
             t = s.search()
             tasks.append(t)
             searchers[t] = s
-        self._process(searchers, tasks)
+        await self._process(searchers, tasks)
 
-    def _get_user(self):
+    async def _get_user(self):
         searcher = self._build_searcher(self.searcher_config)
         if not searcher:
             self.q.put(ResultMessage(ResultType.AllFinished))
@@ -343,18 +718,245 @@ class _MultiSearcherInvoker:
             t = s.get_userinfo()
             tasks.append(t)
             searchers[t] = s
-        self._process(searchers, tasks)
+        await self._process(searchers, tasks)
+
+
+class _JobQueue:
+    """
+    给工作进程中的结果加上任务编号，放入共用的结果队列
+    """
+
+    def __init__(self, job_id: int, results: Queue):
+        self.job_id = job_id
+        self.results = results
+
+    def put(self, message: ResultMessage):
+        self.results.put((self.job_id, message))
+
+
+class _PoolWorker:
+    """
+    常驻工作进程，一个事件循环同时执行多个任务，SiteHelper在任务之间复用
+    """
+
+    def __init__(self, jobs: Queue, results: Queue):
+        self.jobs = jobs
+        self.results = results
+
+    def __call__(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(self._serve())
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        site_helpers = _SiteHelperCache()
+        running: Dict[int, asyncio.Task] = {}
+        while True:
+            message = await loop.run_in_executor(None, self.jobs.get)
+            if message is None:
+                break
+            action, job_id, *args = message
+            if action == 'cancel':
+                if job_id in running:
+                    running[job_id].cancel()
+                continue
+            task = asyncio.ensure_future(self._run(job_id, site_helpers, *args))
+            running[job_id] = task
+            task.add_done_callback(lambda t, i=job_id: running.pop(i, None))
+        for task in list(running.values()):
+            task.cancel()
+        await asyncio.gather(*running.values(), return_exceptions=True)
+        await site_helpers.aclose()
+
+    async def _run(self, job_id: int, site_helpers: _SiteHelperCache, searchers: List[Dict],
+                   functions: Union[SiteInvokerFunction, List[SiteInvokerFunction]], deadline: Optional[float] = None):
+        q = _JobQueue(job_id, self.results)
+        invoker = _MultiSearcherInvoker(searchers, q, functions, site_helpers, deadline)
+        try:
+            await invoker.invoke()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            _LOGGER.exception(f'工作进程执行任务出错：{repr(e)}')
+            q.put(ResultMessage(ResultType.AllFinished))
+
+
+class MultiSiteWorkerPool:
+    """
+    常驻的多站点工作进程池，每个进程一个事件循环，保留已创建的SiteHelper、解析计划和连接池
+    任务提交后结果放入调用方的队列，与MultiSiteProcess的结果格式相同，最后一条为AllFinished
+    """
+
+    def __init__(self, processes: Optional[int] = None):
+        """
+        :param processes: 工作进程数，默认为CPU核数；站点未指定parse_executor时工作进程内在当前协程解析，不会再创建解析进程池
+        """
+        self.processes = max(1, processes or os.cpu_count() or 1)
+        self._workers: List[Optional[Process]] = [None] * self.processes
+        self._jobs: List[Optional[Queue]] = [None] * self.processes
+        self._results: Optional[Queue] = None
+        self._routes: Dict[int, tuple] = {}
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._dispatcher: Optional[threading.Thread] = None
+
+    def _start_worker(self, i: int):
+        self._jobs[i] = Queue()
+        self._workers[i] = Process(target=_PoolWorker(self._jobs[i], self._results), name=f'MultiSiteWorker-{i}')
+        self._workers[i].start()
+
+    def start(self):
+        with self._lock:
+            if self._dispatcher is not None:
+                return
+            self._results = Queue()
+            for i in range(self.processes):
+                self._start_worker(i)
+            self._dispatcher = threading.Thread(target=self._dispatch, name='MultiSiteDispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                break
+            job_id, message = item
+            with self._lock:
+                route = self._routes.get(job_id)
+                if route is not None and message.result_type == ResultType.AllFinished:
+                    del self._routes[job_id]
+            if route is not None:
+                route[1].put(message)
+
+    def submit(self, searchers: List[Dict], functions: Union[SiteInvokerFunction, List[SiteInvokerFunction]],
+               q, timeout: Optional[float] = None) -> int:
+        """
+        提交任务，交给当前任务最少的工作进程执行，进程意外退出时重新启动
+        :param searchers: 与MultiSiteProcess相同的站点配置
+        :param functions:
+        :param q: 接收结果的队列，有put方法即可
+        :param timeout: 从提交开始计算的最长秒数，到达后未完成的站点按超时返回
+        :return: 任务编号，用于取消任务
+        """
+        deadline = time.time() + timeout if timeout else None
+        self.start()
+        with self._lock:
+            job_id = next(self._job_ids)
+            load = [0] * self.processes
+            for worker, _ in self._routes.values():
+                load[worker] += 1
+            i = load.index(min(load))
+            if not self._workers[i].is_alive():
+                _LOGGER.warning(f'工作进程{self._workers[i].name}已退出，重新启动')
+                for other in [k for k, v in self._routes.items() if v[0] == i]:
+                    self._routes.pop(other)[1].put(ResultMessage(ResultType.AllFinished))
+                self._start_worker(i)
+            self._routes[job_id] = (i, q)
+            self._jobs[i].put(('run', job_id, searchers, functions, deadline))
+        return job_id
+
+    def cancel(self, job_id: int):
+        """
+        取消未完成的任务，之后不再返回此任务的结果
+        :param job_id:
+        :return:
+        """
+        with self._lock:
+            route = self._routes.pop(job_id, None)
+            if route is not None:
+                self._jobs[route[0]].put(('cancel', job_id))
+
+    def run(self, searchers: List[Dict],
+            functions: Union[SiteInvokerFunction, List[SiteInvokerFunction]],
+            timeout: Optional[float] = None) -> Iterator[ResultMessage]:
+        """
+        提交任务并依次返回结果，不包含AllFinished，提前停止迭代时取消任务
+        :param searchers:
+        :param functions:
+        :param timeout: 任务的最长秒数，到达后未完成的站点按超时返回
+        :return:
+        """
+        q = queue.Queue()
+        job_id = self.submit(searchers, functions, q, timeout)
+        # 工作进程没有响应时最多再等待这么久，超时抛出queue.Empty
+        wait_until = time.monotonic() + timeout + RESULT_GRACE_SECS if timeout else None
+        try:
+            while True:
+                message = q.get(timeout=max(0.0, wait_until - time.monotonic()) if wait_until else None)
+                if message.result_type == ResultType.AllFinished:
+                    return
+                yield message
+        finally:
+            self.cancel(job_id)
+
+    def close(self):
+        with self._lock:
+            if self._dispatcher is None:
+                return
+            for jobs in self._jobs:
+                jobs.put(None)
+            for worker in self._workers:
+                worker.join(10)
+                if worker.is_alive():
+                    worker.terminate()
+            self._results.put(None)
+            dispatcher = self._dispatcher
+            self._dispatcher = None
+            self._routes.clear()
+        dispatcher.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_WORKER_POOL: Optional[MultiSiteWorkerPool] = None
+_WORKER_POOL_LOCK = threading.Lock()
+
+
+def get_worker_pool(processes: Optional[int] = None) -> MultiSiteWorkerPool:
+    """
+    获取进程内共用的工作进程池，首次获取时创建，进程退出时关闭
+    :param processes: 工作进程数，只在首次创建时生效，默认为CPU核数
+    :return:
+    """
+    global _WORKER_POOL
+    with _WORKER_POOL_LOCK:
+        if _WORKER_POOL is None:
+            _WORKER_POOL = MultiSiteWorkerPool(processes)
+            atexit.register(_WORKER_POOL.close)
+        return _WORKER_POOL
 
 
 class MultiSiteProcess:
+    """
+    在工作进程中执行多站点任务，结果放入q；任务交给常驻的工作进程池，退出时取消未完成的任务
+    """
+
     def __init__(self, searchers: List[Dict], q: Queue,
-                 functions: Union[SiteInvokerFunction, List[SiteInvokerFunction]]):
-        self.process = Process(target=_MultiSearcherInvoker(searchers, q, functions),
-                               name='MultiSearchProcess')
+                 functions: Union[SiteInvokerFunction, List[SiteInvokerFunction]],
+                 pool: Optional[MultiSiteWorkerPool] = None, timeout: Optional[float] = None):
+        """
+        :param searchers:
+        :param q:
+        :param functions:
+        :param pool: 为空时使用进程内共用的工作进程池
+        :param timeout: 最长秒数，到达后已完成的站点正常返回，未完成的站点返回Timeout
+        """
+        self.searchers = searchers
+        self.q = q
+        self.functions = functions
+        self.pool = pool or get_worker_pool()
+        self.timeout = timeout
+        self.job_id = None
 
     def __enter__(self):
-        self.process.start()
+        self.job_id = self.pool.submit(self.searchers, self.functions, self.q, self.timeout)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.process.terminate()
+        self.pool.cancel(self.job_id)
@@ -3,6 +3,9 @@ import logging
 import random
 import re
 import string
+from functools import lru_cache
+from typing import Optional, Dict, List, Tuple, Pattern
+
 import emoji
 import math
 from jinja2 import Template
@@ -12,6 +15,46 @@ _LOGGER = logging.getLogger(__name__)
 DES_KEY = 'KHp*7#fv'
 punctuation = """！？｡＂＃＄％＆＇（）＊＋－／：；＜＝＞＠［＼］＾＿｀｛｜｝～｟｠｢｣､、〃》「」『』【】〔〕〖〗〘〙〚〛〜〝〞〟〰〾〿–—‘’‛“”„‟…‧﹏"""
 re_punctuation = "[{}]+".format(punctuation)
+TEMPLATE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _compile_template(text: str) -> Template:
+    return Template(text)
+
+
+@lru_cache(maxsize=1)
+def _emoji_table() -> Tuple[Pattern, Dict[str, List[int]], Dict[str, str]]:
+    """
+    预先生成emoji替换表，替换结果与emoji.demojize一致
+    返回候选字符正则、所有emoji的前缀集合、emoji到:name:的映射
+    """
+    table = {k: ':' + v['en'][1:-1] + ':' for k, v in emoji.EMOJI_DATA.items() if 'en' in v}
+    # demojize按前缀树匹配，匹配到不能再延长为止，因此要用全部emoji（含未翻译的）构建前缀
+    prefixes = {k[:n] for k in emoji.EMOJI_DATA for n in range(1, len(k) + 1)}
+    firsts = {k[0] for k in emoji.EMOJI_DATA}
+    # 非ASCII首字符合并为少量区间，区间内多出的字符会在查表时排除
+    codes = sorted(ord(c) for c in firsts if not c.isascii())
+    ranges = [[codes[0], codes[0]]]
+    for c in codes[1:]:
+        if c - ranges[-1][1] > 128:
+            ranges.append([c, c])
+        else:
+            ranges[-1][1] = c
+    # 数字、#、*开头的键帽emoji后面必然跟着变体选择符或键帽符
+    ascii_firsts = ''.join(sorted(c for c in firsts if c.isascii()))
+    pattern = '[' + re.escape(ascii_firsts) + '][\ufe0f\u20e3]|[' + ''.join(
+        f'{re.escape(chr(a))}-{re.escape(chr(b))}' for a, b in ranges) + ']'
+    return re.compile(pattern), prefixes, table
+
+
+def _strip_variation_selectors(text: str) -> str:
+    """
+    去掉emoji之外多余的变体选择符，与emoji.demojize一致
+    """
+    if '\ufe0f' in text or '\ufe0e' in text:
+        return text.replace('\ufe0f', '').replace('\ufe0e', '')
+    return text
 
 
 class StringUtils:
@@ -20,11 +63,34 @@ class StringUtils:
     @staticmethod
     def trim_emoji(text):
         """
-        去掉字符串中的emoji表情
+        去掉字符串中的emoji表情，替换为:name:形式的文字，结果与emoji.demojize一致
         :param text:
         :return:
         """
-        return emoji.demojize(text)
+        if not text or text.isascii():
+            return text
+        candidate, prefixes, table = _emoji_table()
+        out = None
+        pos = 0
+        for m in candidate.finditer(text):
+            i = m.start()
+            if i < pos or text[i] not in prefixes:
+                continue
+            j = i + 1
+            while j < len(text) and text[i:j + 1] in prefixes:
+                j += 1
+            if text[i:j] not in emoji.EMOJI_DATA:
+                continue
+            if out is None:
+                out = []
+            out.append(text[pos:i])
+            # 没有英文名的emoji原样保留
+            out.append(table.get(text[i:j], text[i:j]))
+            pos = j
+        if out is None:
+            return _strip_variation_selectors(text)
+        out.append(text[pos:])
+        return _strip_variation_selectors(''.join(out))
 
     @staticmethod
     def noisestr(text):
@@ -76,6 +142,17 @@ class StringUtils:
                                 str(context[var_name]) if var_name in context else '')
         return text
 
+    @staticmethod
+    def get_template(text) -> Optional[Template]:
+        """
+        获取模版文本编译后的Jinja模版，按模版原文在进程内共享缓存，不含模版语法时返回None
+        :param text:
+        :return:
+        """
+        if not isinstance(text, str) or text.find('{') == -1:
+            return
+        return _compile_template(text)
+
     @staticmethod
     def render_text(text, **context):
         """
@@ -86,7 +163,7 @@ class StringUtils:
         """
         if not context or len(context) == 0:
             return text
-        template = Template(text)
+        template = _compile_template(text)
         try:
             return template.render(**context)
         except Exception as e:
@@ -0,0 +1,53 @@
+import hashlib
+from typing import Optional
+
+
+class TorrentUtils:
+    """种子文件工具"""
+
+    @staticmethod
+    def _skip_value(data: bytes, i: int) -> int:
+        """
+        跳过一个bencode编码的值，返回值结束后的位置
+        :param data:
+        :param i: 值开始的位置
+        :return:
+        """
+        c = data[i:i + 1]
+        if c == b'i':
+            return data.index(b'e', i) + 1
+        if c == b'l' or c == b'd':
+            i += 1
+            while data[i:i + 1] != b'e':
+                if i >= len(data):
+                    raise ValueError('bencode数据不完整')
+                i = TorrentUtils._skip_value(data, i)
+            return i + 1
+        if c.isdigit():
+            colon = data.index(b':', i)
+            end = colon + 1 + int(data[i:colon])
+            if end > len(data):
+                raise ValueError('bencode数据不完整')
+            return end
+        raise ValueError(f'不是有效的bencode数据，位置{i}')
+
+    @staticmethod
+    def get_infohash(content: bytes) -> Optional[str]:
+        """
+        计算种子的infohash，即info字典原始bencode内容的SHA1
+        :param content: 种子文件内容
+        :return: 不是有效的种子文件时返回None
+        """
+        if not content or not content.startswith(b'd'):
+            return
+        try:
+            i = 1
+            while content[i:i + 1] != b'e':
+                key_end = TorrentUtils._skip_value(content, i)
+                value_end = TorrentUtils._skip_value(content, key_end)
+                if content[content.index(b':', i) + 1:key_end] == b'info':
+                    return hashlib.sha1(content[key_end:value_end]).hexdigest()
+                i = value_end
+        except (ValueError, IndexError):
+            return
+        return
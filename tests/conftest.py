@@ -0,0 +1,42 @@
+import httpx
+import pytest
+
+from autoptspider.site.sitehelper import SiteHelper
+from tests.utils import load_mteam_config
+
+
+@pytest.fixture
+def mock_transport(monkeypatch):
+    """
+    把httpx.AsyncClient的请求交给handler处理，不访问网络
+    :return: 安装函数，参数为handler，返回之后创建的客户端列表
+    """
+    clients = []
+    async_client = httpx.AsyncClient
+
+    class MockClient(async_client):
+        def __init__(self, *args, **kwargs):
+            kwargs.pop('proxies', None)
+            kwargs['transport'] = httpx.MockTransport(handler)
+            super().__init__(*args, **kwargs)
+            clients.append(self)
+
+    handler = None
+
+    def install(fn):
+        nonlocal handler
+        handler = fn
+        monkeypatch.setattr(httpx, 'AsyncClient', MockClient)
+        return clients
+
+    return install
+
+
+@pytest.fixture
+def site_config():
+    return load_mteam_config()
+
+
+@pytest.fixture
+def mteam_helper(site_config):
+    return SiteHelper(site_config, 'tp=test')
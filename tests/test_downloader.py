@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import os
+
+import httpx
+
+from autoptspider.site.downloader import download_many, DownloadStatus
+from autoptspider.site.sitehelper import SiteHelper
+from autoptspider.utils.torrentutils import TorrentUtils
+from tests.utils import load_mteam_config
+
+
+def test_stream_download(mock_transport, tmp_path, mteam_helper):
+    """
+    下载时只读取开头判断是否为网页，种子内容写入临时文件后改名，需要确认时提交确认后再下载
+    :return:
+    """
+    torrent = b'd8:announce' + b'0' * 100000 + b'e'
+    notice = '<html><body>下载提示<form><input name="id" value="701001"></form></body></html>'.encode('utf-8')
+
+    def handler(request):
+        if request.url.path.endswith('downloadnotice.php'):
+            assert request.content == b'id=701001&type=ratio'
+            return httpx.Response(200, content=torrent)
+        if 'notice' in str(request.url):
+            return httpx.Response(200, content=notice)
+        return httpx.Response(200, content=torrent, headers={'content-type': 'application/x-bittorrent'})
+
+    mock_transport(handler)
+    helper = mteam_helper
+    asyncio.run(helper.download('https://kp.m-team.cc/download.php?id=1', str(tmp_path / 'a.torrent')))
+    asyncio.run(helper.download('https://kp.m-team.cc/download.php?id=1&notice=1', str(tmp_path / 'b.torrent')))
+    assert (tmp_path / 'a.torrent').read_bytes() == torrent
+    assert (tmp_path / 'b.torrent').read_bytes() == torrent
+    assert sorted(os.listdir(tmp_path)) == ['a.torrent', 'b.torrent']
+
+
+def test_download_many(mock_transport, tmp_path):
+    """
+    批量下载按站点调度，按infohash去重，单个失败不影响其他
+    :return:
+    """
+    def torrent(name: bytes):
+        info = b'd6:lengthi1e4:name' + str(len(name)).encode() + b':' + name + b'e'
+        return b'd8:announce3:url4:info' + info + b'e', hashlib.sha1(info).hexdigest()
+
+    first, first_hash = torrent(b'first')
+    second, _ = torrent(b'second')
+    assert TorrentUtils.get_infohash(first) == first_hash
+    assert TorrentUtils.get_infohash(b'<html>') is None and TorrentUtils.get_infohash(b'd4:info') is None
+
+    def handler(request):
+        tid = request.url.params.get('id')
+        if tid == '404':
+            return httpx.Response(404)
+        if tid == 'err':
+            return httpx.Response(200, content='<html>下载出错</html>'.encode('utf-8'))
+        return httpx.Response(200, content=second if tid == '2' else first)
+
+    mock_transport(handler)
+    a, b = [SiteHelper(load_mteam_config(site_id), 'tp=test') for site_id in ['mteam_a', 'mteam_b']]
+    url = 'https://kp.m-team.cc/download.php?id='
+    jobs = [(a, url + '1', str(tmp_path / 'a1')), (a, url + '2', str(tmp_path / 'a2')),
+            (b, url + '1', str(tmp_path / 'b1')), (a, url + '404', str(tmp_path / 'a404')),
+            (b, url + 'err', str(tmp_path / 'berr')), (a, url + '1', str(tmp_path / 'a1_again'))]
+    results = asyncio.run(download_many(jobs))
+    statuses = [r.status for r in results]
+    assert statuses[1] == DownloadStatus.Downloaded and statuses[3:] == [
+        DownloadStatus.NotFound, DownloadStatus.Error, DownloadStatus.Duplicate]
+    assert sorted(statuses[0::2][:2]) == [DownloadStatus.Downloaded, DownloadStatus.Duplicate]
+    assert results[0].infohash == results[2].infohash == results[5].infohash == first_hash
+    assert sorted(os.listdir(tmp_path)) == sorted(['a2', 'a1' if statuses[0] == DownloadStatus.Downloaded else 'b1'])
+    assert results[4].err_msg and results[4].site_id == 'mteam_b'
+
+
+def test_download_many_keeps_files(mock_transport, tmp_path):
+    """
+    保存路径相同的重复种子不会删除已保存的文件，站点返回404时不会把已有的旧文件当作下载成功
+    :return:
+    """
+    info = b'd6:lengthi1e4:name4:samee'
+    content = b'd8:announce3:url4:info' + info + b'e'
+
+    def handler(request):
+        if request.url.params.get('id') == '404':
+            return httpx.Response(404)
+        return httpx.Response(200, content=content)
+
+    mock_transport(handler)
+    a, b = [SiteHelper(load_mteam_config(site_id), 'tp=test') for site_id in ['mteam_a', 'mteam_b']]
+    url = 'https://kp.m-team.cc/download.php?id='
+    target = str(tmp_path / 'same.torrent')
+    results = asyncio.run(download_many([(a, url + '1', target), (b, url + '1', target)]))
+    assert sorted(r.status for r in results) == [DownloadStatus.Downloaded, DownloadStatus.Duplicate]
+    assert os.listdir(tmp_path) == ['same.torrent'] and (tmp_path / 'same.torrent').read_bytes() == content
+    (tmp_path / 'old.torrent').write_bytes(b'old')
+    results = asyncio.run(download_many([(a, url + '404', str(tmp_path / 'old.torrent'))]))
+    assert results[0].status == DownloadStatus.NotFound
+    assert (tmp_path / 'old.torrent').read_bytes() == b'old' and len(os.listdir(tmp_path)) == 2
@@ -0,0 +1,52 @@
+import datetime
+
+from autoptspider.site.fieldtemplate import get_field_template
+from autoptspider.utils.stringutils import StringUtils
+from tests.utils import get_mteam_helper
+
+
+def test_templates_shared_between_helpers():
+    """
+    模版按原文在进程内共享，多次创建SiteHelper不会重复编译，也不会修改适配文件
+    :return:
+    """
+    first = get_mteam_helper()
+    second = get_mteam_helper()
+    title = [f for f in first.site_plan.torrents.fields.fields if f.key == 'title'][0]
+    title2 = [f for f in second.site_plan.torrents.fields.fields if f.key == 'title'][0]
+    assert title.template is not None and title.template is title2.template
+    assert first.search_query['search'] is second.search_query['search']
+    assert '_template' not in first.site_config['torrents']['fields']['title']
+    assert StringUtils.get_template('plain text') is None
+
+
+def test_native_field_template_same_as_jinja():
+    """
+    原生编译的字段模版与Jinja渲染结果一致，不能识别的写法退回Jinja
+    :return:
+    """
+    sources = [
+        "{% if fields['title_optional'] %}{{ fields['title_optional'] }}{% else %}{{ fields['title_default'] }}{% endif %}",
+        "{% if fields['date_elapsed'] or fields['date_added'] %}{{ fields['date_elapsed'] if fields['date_elapsed'] "
+        "else fields['date_added'] }}{% else %}now{% endif %}",
+        "{% if fields['downloadvolumefactor']==0 %}{{max_time}}{% endif%}",
+        "{{ fields['missing'] }}-{{ fields['none'] }}-{{ fields.title_default }}",
+        "{% if not fields['x'] %}a{% elif fields['y'] != 1 %}b{% else %}c{% endif %} {{ userinfo['uid'] }}",
+        "{{ fields['y'] if fields['x'] }}",
+    ]
+    values_list = [
+        {'title_optional': 'opt', 'title_default': 'def', 'date_elapsed': None, 'date_added': '2023-01-01',
+         'downloadvolumefactor': 0, 'none': None, 'x': 1, 'y': 2},
+        {'title_optional': None, 'title_default': 'def', 'downloadvolumefactor': 1.0, 'x': 0, 'y': 1},
+    ]
+    context = {'userinfo': {'uid': 10}}
+    for source in sources:
+        tmpl = get_field_template(source)
+        assert tmpl.native is not None, source
+        for values in values_list:
+            expected = StringUtils.get_template(source).render(
+                {'fields': values, 'now': None, 'max_time': datetime.datetime.max, **context})
+            assert tmpl.render(values, context, max_time=datetime.datetime.max) == expected
+    tmpl = get_field_template("{{ fields['title'] | upper }}")
+    assert tmpl.native is None
+    assert tmpl.render({'title': 'abc'}) == 'ABC'
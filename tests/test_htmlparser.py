@@ -0,0 +1,18 @@
+import datetime
+
+from autoptspider.site.htmlparser import HtmlParser, compile_filters
+
+
+def test_compile_filters_same_as_filter_value():
+    filters = [
+        {'name': 're_search', 'args': [r'(?:限時：\s*)((?:\d+日)?(?:\d+時)?(?:\d+分)?)', 1]},
+        {'name': 'replace', 'args': ['時', '时']},
+        {'name': 'rstrip', 'args': ['分']},
+        {'name': 'unknown'},
+    ]
+    fn = compile_filters(filters)
+    for value in ['限時：1日12時30分', '', None]:
+        assert fn(value) == HtmlParser._filter_value(value, filters)
+    fn = compile_filters([{'name': 'dateparse', 'args': '%Y-%m-%d %H:%M:%S'}])
+    assert fn('2023-03-01 12:00:00') == datetime.datetime(2023, 3, 1, 12, 0)
+    assert fn('3天前') is None
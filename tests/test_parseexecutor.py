@@ -0,0 +1,31 @@
+import asyncio
+import pickle
+
+import pytest
+
+from autoptspider.site.parseexecutor import get_parse_executor, parse_page, PAGE_TORRENTS, PAGE_USERINFO
+from autoptspider.site.siteexceptions import LoginRequired
+from tests.utils import load_html, get_mteam_helper, without_now
+
+
+def test_parse_executor():
+    """
+    线程池、进程池中解析的结果与当前协程中解析一致，执行计划序列化时只传站点配置
+    :return:
+    """
+    helper = get_mteam_helper()
+    content = load_html('mteam_torrents.html').encode('utf-8')
+    plan = pickle.loads(pickle.dumps(helper.site_plan))
+    assert plan.site_config == helper.site_plan.site_config
+    assert pickle.loads(pickle.dumps(helper.site_plan)) is plan
+    expected = parse_page(helper.site_plan, content, PAGE_TORRENTS)
+    assert expected['userinfo']['uid'] == '123456' and len(expected['items']) == 5
+    for name in ['inline', 'thread', 'process']:
+        executor = get_parse_executor(name)
+        assert executor.name == name and get_parse_executor(name) is executor
+        actual = asyncio.run(executor.run(parse_page, helper.site_plan, content, PAGE_TORRENTS))
+        assert [without_now(i) for i in actual['items']] == [without_now(i) for i in expected['items']]
+    with pytest.raises(LoginRequired) as e:
+        asyncio.run(get_parse_executor('process').run(
+            parse_page, helper.site_plan, content.replace(b'logout.php', b'login.php'), PAGE_USERINFO))
+    assert e.value.site_id == 'mteam'
@@ -4,22 +4,7 @@ import os
 from moviebotapi.site import CateLevel1
 
 from autoptspider.site.sitehelper import SiteHelper
-import yaml
-
-TMPL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
-
-
-def load_yaml_config(filepath: str):
-    """
-    加载一个yaml格式的文件
-    :param filepath:
-    :return:
-    """
-    if not filepath or not os.path.exists(filepath):
-        raise FileNotFoundError(f'找不到配置文件: {filepath}')
-    with open(filepath, 'r', encoding='utf-8') as file:
-        user_config = yaml.safe_load(file)
-    return user_config
+from tests.utils import load_yaml_config, TMPL_PATH
 
 
 def get_mteam():
@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import pytest
+
+from autoptspider.site.ratelimiter import get_rate_limiter, REQUEST, DOWNLOAD
+from autoptspider.site.sitehelper import SiteHelper
+from tests.utils import get_mteam_helper
+
+
+def test_adaptive_rate_limiter():
+    """
+    站点提示负载过高时速率减半并暂停，之后每次成功缓慢提高，同一站点的SiteHelper共用限速器
+    :return:
+    """
+    limiter = get_rate_limiter('test_site', REQUEST, {'rate': 4, 'max_rate': 8, 'increase': 1})
+    assert get_rate_limiter('test_site', REQUEST) is limiter
+    limiter.on_overload()
+    assert limiter.rate == 2
+    # 同一批并发请求的报错只降一次速
+    limiter.on_overload()
+    assert limiter.rate == 2
+    limiter.on_success()
+    assert limiter.rate == 3
+
+    async def acquire():
+        start = time.monotonic()
+        await limiter.acquire()
+        await limiter.acquire()
+        return time.monotonic() - start
+
+    assert 0.3 < asyncio.run(acquire()) < 1
+    helper = SiteHelper({**get_mteam_helper().site_config, 'id': 'test_site'})
+    assert helper.request_limiter is limiter and helper.download_limiter.rate == 1 / 15
+
+
+def test_unconfigured_rate_limiter():
+    """
+    未配置限速时普通请求不限速，站点要求暂停时仍然等待
+    :return:
+    """
+    limiter = get_rate_limiter('test_unlimited', REQUEST)
+    assert get_rate_limiter('test_unlimited', DOWNLOAD).rate == 1 / 15
+
+    async def acquire(count):
+        start = time.monotonic()
+        for _ in range(count):
+            await limiter.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(acquire(100)) < 0.1
+    limiter.on_overload()
+    limiter.on_success()
+    assert asyncio.run(acquire(100)) < 0.1
+    limiter.on_overload(0.3)
+    assert 0.2 < asyncio.run(acquire(2)) < 0.6
+
+
+def test_cancelled_acquire_returns_slot():
+    """
+    等待被取消时归还请求时间，后面的请求不用多等
+    :return:
+    """
+    limiter = get_rate_limiter('test_cancel', REQUEST, {'rate': 2, 'max_rate': 2})
+
+    async def run():
+        await limiter.acquire()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.acquire(), 0.1)
+        start = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) < 0.7
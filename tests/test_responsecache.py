@@ -0,0 +1,72 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+
+from autoptspider.site.responsecache import MemoryResponseCache, DiskResponseCache, CachedResponse
+from autoptspider.site.sitehelper import SiteHelper
+from tests.utils import load_html
+
+
+@pytest.mark.parametrize('backend', ['memory', 'disk'])
+def test_response_cache(mock_transport, tmp_path, backend, site_config):
+    """
+    缓存未过期时不发请求，过期或要求刷新时条件请求，站点返回304时使用缓存内容，不同Cookie分开缓存
+    :return:
+    """
+    content = load_html('mteam_torrents.html').encode('utf-8')
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.headers.get('if-none-match') == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, content=content, headers={'etag': '"v1"'})
+
+    mock_transport(handler)
+    cache = MemoryResponseCache() if backend == 'memory' else DiskResponseCache(str(tmp_path))
+    site_config['cache'] = {'userinfo': 300, 'list': 0}
+    helper = SiteHelper(site_config, 'tp=test', response_cache=cache)
+    user = asyncio.run(helper.get_userinfo(refresh=True))
+    assert asyncio.run(helper.get_userinfo()).username == user.username
+    assert len(requests) == 1 and cache.stats() == {'hits': 1, 'misses': 1, 'revalidated': 0}
+    # 要求刷新时缓存未过期也条件请求
+    assert asyncio.run(helper.get_userinfo(refresh=True)).username == user.username
+    assert len(requests) == 2 and requests[-1].headers['if-none-match'] == '"v1"'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'revalidated': 1}
+    # 其他Cookie不能命中
+    other = SiteHelper(site_config, 'tp=other', response_cache=cache)
+    asyncio.run(other.get_userinfo(refresh=True))
+    assert len(requests) == 3 and cache.misses == 2
+    # 缓存0秒的页面每次都条件请求
+    site_config['list'] = {**site_config['torrents'], 'path': 'torrents.php'}
+    helper = SiteHelper(site_config, 'tp=test', response_cache=cache)
+    assert len(asyncio.run(helper.list())) == len(asyncio.run(helper.list())) > 0
+    assert requests[-1].headers['if-none-match'] == '"v1"'
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'revalidated': 2}
+
+
+def test_disk_response_cache(tmp_path):
+    """
+    磁盘缓存只存原始字节和json元数据，元数据与内容不配套时不使用，超过上限时淘汰最久未使用的缓存
+    :return:
+    """
+    cache = DiskResponseCache(str(tmp_path), max_entries=2)
+    cache.set('a', CachedResponse(b'aaa', etag='"a"'))
+    cache.set('b', CachedResponse(b'bbb'))
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [os.path.basename(cache._path(k)) + suffix for k in ('a', 'b') for suffix in ('.body', '.json')])
+    assert cache.get('a').content == b'aaa' and cache.get('a').etag == '"a"'
+    # 内容被其他进程改写后大小不符
+    with open(cache._path('b') + '.body', 'wb') as file:
+        file.write(b'changed')
+    assert cache.get('b') is None
+    # 刚读过a，写入c时淘汰b
+    os.utime(cache._path('b') + '.json', (0, 0))
+    cache.set('c', CachedResponse(b'ccc'))
+    assert cache.get('b') is None and cache.get('a') is not None and cache.get('c') is not None
+    assert len(os.listdir(tmp_path)) == 4
+    cache.max_bytes = 0
+    cache.set('d', CachedResponse(b'ddd'))
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,27 @@
+from autoptspider.site.responseclassifier import ResponseClassifier, ResponseKind, parse_js_string_expression
+
+
+def test_response_classifier():
+    """
+    一次扫描识别特殊页面，大页面只检查开头和结尾，水墙跳转地址只解析字符串拼接
+    :return:
+    """
+    classifier = ResponseClassifier(encoding='gbk')
+    assert classifier.classify(200, '<html>负载过高，120秒后自动刷新</html>'.encode('gbk')).kind == ResponseKind.Overload
+    assert classifier.classify(200, '<p>请求次数过多</p>'.encode('utf-8')).kind == ResponseKind.RateLimited
+    assert classifier.classify(429, b'').kind == ResponseKind.RateLimited
+    assert classifier.classify(200, b'<title>Just a moment...</title>').kind == ResponseKind.Ok
+    assert classifier.classify(503, b'<title>Just a moment...</title>').kind == ResponseKind.CloudflareChallenge
+    page = b'<div data-cf-settings="1"></div><script src="rocket-loader.min.js"></script>'
+    assert classifier.classify(200, page).kind == ResponseKind.Ok
+    verdict = classifier.classify(200, page + b'<script>window.location="/cdn-cgi/"+\'check?a=1\';</script>')
+    assert verdict.kind == ResponseKind.CloudflareRedirect and verdict.redirect == '/cdn-cgi/check?a=1'
+    assert parse_js_string_expression('"/a" + __import__("os").system("ls")') is None
+    assert parse_js_string_expression('"/a\\u0062"') == '/ab'
+    # 标记只出现在大页面中间时不识别
+    filler = b'x' * 20000
+    assert classifier.classify(200, filler + '请求次数过多'.encode('utf-8') + filler).kind == ResponseKind.Ok
+    assert classifier.classify(200, filler + filler + '下载提示'.encode('gbk')).kind == ResponseKind.DownloadNotice
+    classifier = ResponseClassifier({'rate_limited': ['Too many requests']})
+    assert classifier.classify(200, b'Too many requests').kind == ResponseKind.RateLimited
+    assert classifier.classify(200, '请求次数过多'.encode('utf-8')).kind == ResponseKind.Ok
@@ -0,0 +1,155 @@
+from pyquery import PyQuery
+
+from autoptspider.site.fieldtemplate import find_field_refs
+from autoptspider.site.htmlparser import HtmlParser
+from autoptspider.site.parseexecutor import parse_page, PAGE_TORRENTS
+from autoptspider.site.ruleplan import SitePlan, compile_column_selector, compile_simple_key, parse_html
+from autoptspider.site.siteparser import SiteParser
+from autoptspider.utils.stringutils import StringUtils
+from tests.utils import load_html, get_mteam_helper, without_now
+
+
+def test_plan_parse_torrents_same_as_html_parser():
+    """
+    编译后的执行计划解析结果必须与逐行PyQuery解析一致
+    :return:
+    """
+    helper = get_mteam_helper()
+    doc = PyQuery(load_html('mteam_torrents.html'))
+    fields_rule = helper.site_config['torrents']['fields']
+    # 原流程先整页去掉emoji再解析
+    rows = PyQuery(StringUtils.trim_emoji(load_html('mteam_torrents.html')))(
+        helper.site_config['torrents']['list']['selector'])
+    expected = [HtmlParser.parse_item_fields(rows.eq(i), fields_rule) for i in range(rows.length)]
+    plan = helper.site_plan.torrents
+    actual = [plan.fields.parse([row]) for row in plan.select(list(doc))]
+    assert len(actual) == 5
+    assert [without_now(i) for i in actual] == [without_now(i) for i in expected]
+    assert [bool(i['free_deadline']) for i in actual] == [bool(i['free_deadline']) for i in expected]
+
+
+def test_plan_parse_userinfo():
+    helper = get_mteam_helper()
+    with SiteParser(helper.site_config, PyQuery(load_html('mteam_torrents.html')), plan=helper.site_plan) as parser:
+        assert parser.test_login()
+        userinfo = parser.parse_userinfo()
+    assert userinfo['uid'] == '123456'
+    assert userinfo['username'] == 'tester'
+    assert userinfo['uploaded'] == '1.234 TB'
+    assert userinfo['vip_group'] is True
+
+
+def test_plan_fallback_to_pyquery():
+    """
+    无法翻译为XPath的选择器退回PyQuery执行
+    :return:
+    """
+    plan = SitePlan({
+        'torrents': {
+            'list': {'selector': 'tr'},
+            'fields': {'title': {'selector': 'td:bad-pseudo'}}
+        }
+    })
+    assert plan.torrents.xpath is not None
+    assert plan.torrents.fields.fields[0].xpath is None
+
+
+def test_batch_rows_same_as_per_row():
+    """
+    按列批量解析与逐行解析结果一致
+    :return:
+    """
+    helper = get_mteam_helper()
+    doc = list(PyQuery(load_html('mteam_torrents.html')))
+    plan = helper.site_plan.torrents
+    assert plan.batch
+    assert 'date_elapsed' in plan.columns
+    per_row = [plan.fields.parse([row]) for row in plan.select(doc)]
+    batch = plan.parse_rows(doc)
+    assert [without_now(i) for i in batch] == [without_now(i) for i in per_row]
+
+
+def test_column_selector():
+    assert compile_column_selector('tr > td > span[title]')[1] == 2
+    assert compile_column_selector('img.pro_free')[1] == 0
+    # 后代、兄弟组合符和依赖位置的伪类只能逐行执行
+    assert compile_column_selector('table.torrentname td') is None
+    assert compile_column_selector('td + td') is None
+    assert compile_column_selector('a:first') is None
+
+
+def test_case_simple_key():
+    key = compile_simple_key('img.pro_free')
+    assert (key.tag, key.attribute, key.operator, key.value) == ('img', 'class', 'class', 'pro_free')
+    key = compile_simple_key('a[class^="VIP"]')
+    assert (key.tag, key.attribute, key.operator, key.value) == ('a', 'class', '^=', 'VIP')
+    assert compile_simple_key('[alt]').tag is None
+    assert compile_simple_key('img.a.b') is None
+    assert compile_simple_key('td > img.pro_free') is None
+    helper = get_mteam_helper()
+    plan = helper.site_plan.torrents
+    assert plan.fields.case_scan.tags == ('img',)
+    rows = plan.select(list(PyQuery(load_html('mteam_torrents.html'))))
+    scanned = plan.fields.case_scan.scan([rows[1]])
+    assert compile_simple_key('img.pro_50pctdown2up').match(scanned)
+    assert not compile_simple_key('img.pro_50pctdown').match(scanned)
+
+
+def test_parse_response_bytes():
+    """
+    响应字节直接交给lxml解析，字段值去掉emoji后与先整页解码、去emoji再解析的结果一致
+    :return:
+    """
+    helper = get_mteam_helper()
+    text = load_html('mteam_torrents.html')
+    doc = parse_html(text.encode('utf-8'), helper.get_encoding())
+    expected = HtmlParser.parse_item_fields(
+        PyQuery(StringUtils.trim_emoji(text))(helper.site_config['torrents']['list']['selector']).eq(2),
+        helper.site_config['torrents']['fields'])
+    actual = helper.site_plan.torrents.parse_rows([doc])
+    assert ':musical_note:' in expected['title']
+    assert without_now(actual[2]) == without_now(expected)
+    assert parse_html(b'', helper.get_encoding()) is None
+    plan = SitePlan({**helper.site_config, 'trim_emoji': False})
+    assert '🎵' in plan.torrents.parse_rows([doc])[2]['title']
+
+
+def test_trim_page():
+    """
+    预裁剪后只解析需要的片段，结果与解析整页一致，片段找不到时解析整页
+    :return:
+    """
+    helper = get_mteam_helper()
+    content = load_html('mteam_torrents.html').encode('utf-8')
+    trimmed = helper.site_plan.trim.slice(content)
+    assert trimmed.startswith(b'<html><body><table id="info_block"')
+    assert b'class="head"' not in trimmed and trimmed.endswith(b'</table></body></html>')
+    full = parse_html(content, helper.get_encoding())
+    doc = parse_html(content, helper.get_encoding(), helper.site_plan.trim)
+    assert [without_now(i) for i in helper.site_plan.torrents.parse_rows([doc])] == \
+           [without_now(i) for i in helper.site_plan.torrents.parse_rows([full])]
+    with SiteParser(helper.site_config, PyQuery(doc), plan=helper.site_plan) as parser:
+        assert parser.parse_userinfo()['uid'] == '123456'
+    assert helper.site_plan.trim.slice(content.replace(b'id="info_block"', b'id="other"')) is None
+    plan = SitePlan({'trim': [{'start': '<table class="torrents"', 'end': '</table>'}]})
+    # 配置了end时截取到第一个end标记为止
+    assert plan.trim.slice(content).count(b'</table>') == 1
+
+
+def test_field_projection():
+    """
+    只解析需要的字段及其模版依赖的字段，结果与完整解析中对应字段一致
+    :return:
+    """
+    helper = get_mteam_helper()
+    content = load_html('mteam_torrents.html').encode('utf-8')
+    plan = helper.site_plan.project(PAGE_TORRENTS, ['id', 'title', 'seeders'])
+    assert plan is helper.site_plan.project(PAGE_TORRENTS, ('seeders', 'title', 'id'))
+    assert [f.key for f in plan.fields.fields] == ['id', 'title_default', 'title_optional', 'title', 'seeders']
+    full = parse_page(helper.site_plan, content, PAGE_TORRENTS)['items']
+    projected = parse_page(helper.site_plan, content, PAGE_TORRENTS, fields=('id', 'title', 'seeders'))['items']
+    assert projected == [{k: i[k] for k in projected[0]} for i in full]
+    # free_deadline的模版引用了downloadvolumefactor
+    keys = [f.key for f in helper.site_plan.project(PAGE_TORRENTS, ['free_deadline']).fields.fields]
+    assert 'downloadvolumefactor' in keys and 'title' not in keys
+    assert find_field_refs("{{ fields[name] }}") is None
@@ -0,0 +1,249 @@
+import asyncio
+import os
+
+import httpx
+import pytest
+from moviebotapi.site import CateLevel1
+
+from autoptspider.site.basesitehelper import BATCH_UNMATCHED
+from autoptspider.site.siteexceptions import RateLimitException
+from autoptspider.site.sitehelper import SiteHelper
+from autoptspider.site.sitesearcher import SiteSearcher
+from autoptspider.utils.stringutils import StringUtils
+from tests.utils import load_html, load_mteam_config, get_mteam_helper
+
+
+def test_persistent_client(mock_transport, monkeypatch, mteam_helper):
+    """
+    同一站点的请求复用一个连接池客户端，事件循环结束时关闭，事件循环变化或关闭后重新创建
+    :return:
+    """
+    content = load_html('mteam_torrents.html').encode('utf-8')
+    clients = mock_transport(lambda request: httpx.Response(200, content=content))
+    monkeypatch.setattr('autoptspider.site.sitehelper.random.randint', lambda a, b: 0)
+    helper = mteam_helper
+
+    async def search():
+        result = await helper.search(keyword='test', cate_level1_list=[CateLevel1.Movie, CateLevel1.Music])
+        assert helper._get_client() is clients[-1]
+        return result
+
+    assert len(asyncio.run(search())) == 10
+    assert len(clients) == 1
+    asyncio.run(search())
+    # 事件循环结束前关闭了上一个事件循环的连接池
+    assert len(clients) == 2 and clients[0].is_closed
+
+    async def close():
+        await search()
+        await helper.aclose()
+
+    asyncio.run(close())
+    assert clients[-1].is_closed and helper._client is None
+
+
+def test_concurrent_search_paths(mock_transport, site_config):
+    """
+    多个搜索页面并发请求，同时进行的请求不超过配置的并发数，结果按页面顺序合并
+    :return:
+    """
+    content = load_html('mteam_torrents.html')
+    running = []
+    peak = []
+
+    async def handler(request):
+        running.append(request)
+        peak.append(len(running))
+        await asyncio.sleep(0.05 if 'torrents.php' in str(request.url) else 0.01)
+        running.remove(request)
+        path = request.url.path.strip('/').split('.')[0]
+        return httpx.Response(200, content=content.replace('Interstellar', path).encode('utf-8'))
+
+    mock_transport(handler)
+    site_config['search']['concurrency'] = 2
+    helper = SiteHelper(site_config, 'tp=test')
+    result = asyncio.run(helper.search(keyword='test', cate_level1_list=[CateLevel1.Movie, CateLevel1.AV,
+                                                                          CateLevel1.Music]))
+    assert max(peak) == 2
+    assert [t.name.split(' ')[0] for t in result if t.id == 701003] == ['torrents', 'adult', 'music']
+
+
+def test_get_detail_many(mock_transport, site_config):
+    """
+    批量获取详情页，按完成先后返回，同时进行的请求不超过并发数，单个页面出错单独报告
+    :return:
+    """
+    content = load_html('mteam_torrents.html')
+    running = []
+    peak = []
+
+    async def handler(request):
+        running.append(request)
+        peak.append(len(running))
+        tid = request.url.params.get('id')
+        await asyncio.sleep(0.1 if tid == '1' else 0.01)
+        running.remove(request)
+        if tid == 'err':
+            return httpx.Response(200, content=b'<html><body></body></html>')
+        return httpx.Response(200, content=content.replace('<title>', f'<title>detail{tid} ').encode('utf-8'))
+
+    mock_transport(handler)
+    site_config['detail'] = {'item': {'selector': 'html'}, 'fields': {'title': {'selector': 'title'}}}
+    helper = SiteHelper(site_config, 'tp=test')
+    url = 'https://kp.m-team.cc/details.php?id='
+    urls = [url + '1', url + '2', url + 'err', url + '3', url + '2']
+
+    async def collect():
+        return [r async for r in helper.get_detail_many(urls, concurrency=2)]
+
+    results = asyncio.run(collect())
+    assert max(peak) == 2 and len(results) == 4
+    assert results[-1].url == url + '1' and results[-1].detail.name.startswith('detail1')
+    errors = [r for r in results if r.err_msg]
+    assert [r.url for r in errors] == [url + 'err'] and errors[0].detail is None
+
+
+def test_search_single_flight(mock_transport, site_config):
+    """
+    同时进行的相同搜索只请求一次，配置了result_ttl时结果保留一段时间，不同关键字单独请求
+    :return:
+    """
+    content = load_html('mteam_torrents.html').encode('utf-8')
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, content=content)
+
+    mock_transport(handler)
+    helpers = [SiteHelper(site_config, 'tp=test') for _ in range(3)]
+
+    async def search(helper, keyword='flight'):
+        return await helper.search(keyword=keyword, cate_level1_list=[CateLevel1.Movie])
+
+    async def search_all():
+        return await asyncio.gather(*[search(h) for h in helpers], search(helpers[0], 'other'))
+
+    results = asyncio.run(search_all())
+    assert len(requests) == 2 and len({len(r) for r in results}) == 1
+    assert results[0][0] is not results[1][0] and helpers[2].userinfo
+    asyncio.run(search(helpers[0]))
+    assert len(requests) == 3
+    site_config['search']['result_ttl'] = 60
+    helper = SiteHelper(site_config, 'tp=test')
+    asyncio.run(search(helper, 'ttl'))
+    asyncio.run(search(helper, 'ttl'))
+    assert len(requests) == 4
+
+
+def test_rate_limited_page(mock_transport):
+    """
+    站点提示请求过多时抛出RateLimitException并降低请求速率，不再当作正常页面解析
+    :return:
+    """
+    responses = [httpx.Response(429, content=b''),
+                 httpx.Response(200, content='<p>请求次数过多</p>'.encode('utf-8'))]
+    mock_transport(lambda request: responses.pop(0))
+    # 单独的站点编号，降速不影响其他测试共用的限速器
+    helper = SiteHelper(load_mteam_config('mteam_limited'), 'tp=test')
+    for keyword in ['limited', 'limited2']:
+        rate = helper.request_limiter.rate
+        with pytest.raises(RateLimitException):
+            asyncio.run(helper.search(keyword=keyword, cate_level1_list=[CateLevel1.Movie]))
+        assert helper.request_limiter.rate < rate
+    assert not responses
+
+
+def test_headers_isolated_between_helpers(mock_transport, tmp_path):
+    """
+    大量站点在同一事件循环中并发搜索、下载，请求头互不串用，也不修改共享的默认请求头
+    :return:
+    """
+    content = load_html('mteam_torrents.html').encode('utf-8')
+    default_headers = dict(SiteHelper.headers)
+    errors = []
+
+    async def handler(request):
+        await asyncio.sleep(0)
+        i = request.headers['cookie'].split('=')[1]
+        if request.headers['user-agent'] != f'agent-{i}':
+            errors.append(('user-agent', i, request.headers['user-agent']))
+        if request.url.path.endswith('download.php'):
+            if int(i) % 2 and request.headers.get('content-type') != f'application/x-www-form-urlencoded; n={i}':
+                errors.append(('content-type', i, request.headers.get('content-type')))
+            if 'referer' in request.headers:
+                errors.append(('referer', i, request.headers['referer']))
+            return httpx.Response(200, content=b'd4:infod6:lengthi' + i.encode() + b'eee')
+        if 'content-type' in request.headers or request.headers.get('referer') != str(request.url).split('?')[0]:
+            errors.append(('search', i, dict(request.headers)))
+        return httpx.Response(200, content=content)
+
+    mock_transport(handler)
+    helpers = []
+    for i in range(60):
+        site_config = load_mteam_config(f'mteam_{i}', 1000)
+        if i % 2:
+            site_config['download'] = {'method': 'POST', 'content_type': f'application/x-www-form-urlencoded; n={i}'}
+        helpers.append(SiteHelper(site_config, f'tp={i}', user_agent=f'agent-{i}'))
+
+    async def run(i, helper):
+        await helper.search(keyword='test', cate_level1_list=[CateLevel1.Movie])
+        await helper.download(f'https://kp.m-team.cc/download.php?id={i}', str(tmp_path / f'{i}.torrent'))
+        await helper.search(keyword='again', cate_level1_list=[CateLevel1.Movie])
+
+    async def run_all():
+        await asyncio.gather(*[run(i, h) for i, h in enumerate(helpers)])
+
+    asyncio.run(run_all())
+    assert not errors
+    assert dict(SiteHelper.headers) == default_headers and len(os.listdir(tmp_path)) == 60
+    with pytest.raises(TypeError):
+        helpers[0].headers['Referer'] = 'x'
+
+
+def test_legacy_page_text_names():
+    """
+    旧的last_search_text、get_userinfo_page_text仍然可用
+    :return:
+    """
+    helper = get_mteam_helper()
+    text = load_html('mteam_torrents.html')
+    helper.last_search_text = text
+    assert helper.last_search_content == text.encode('utf-8')
+    assert helper.last_search_text == StringUtils.trim_emoji(text)
+    assert asyncio.run(helper.get_userinfo(refresh=False)).uid == 123456
+
+
+def test_batch_keyword_search(mock_transport, site_config):
+    """
+    配置了合并搜索时单个词的关键字只请求一次，结果按关键字的每个词在本地分配，分配不了的结果单独保留
+    多词或带符号的关键字单独搜索
+    :return:
+    """
+    content = load_html('mteam_torrents.html').encode('utf-8')
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, content=content)
+
+    mock_transport(handler)
+    site_config['search']['batch'] = {'max_keywords': 3, 'query': {'search_mode': 1}}
+    helper = SiteHelper(site_config, 'tp=test')
+    assert helper.can_batch_keyword('OST') and not helper.can_batch_keyword('Spider-Man: No Way Home')
+    result = asyncio.run(helper.search_batch(['OST', '2160p', 'Interstellar 720p', 'x264-WiKi'], [CateLevel1.Movie]))
+    assert [r.url.params['search'] for r in requests] == ['Interstellar 720p', 'x264-WiKi', 'OST 2160p']
+    assert requests[2].url.params['search_mode'] == '1' and requests[0].url.params['search_mode'] == '0'
+    assert {k: [t.id for t in v] for k, v in result.items() if k in ('OST', '2160p', BATCH_UNMATCHED)} == {
+        'OST': [701003], '2160p': [701002, 701004], BATCH_UNMATCHED: [701001, 701005]}
+    assert len(result['Interstellar 720p']) == 5
+    searcher = SiteSearcher(helper, [{'key': 'keyword', 'value': 'OST'}, {'key': 'imdb_id', 'value': 'tt0816692'},
+                                     {'key': 'keyword', 'value': 'Interstellar 2014'},
+                                     {'key': 'keyword', 'value': '720p'}], [CateLevel1.Movie])
+    searcher.interval_secs = 0
+    data = asyncio.run(searcher.search())['data']
+    assert sorted(t.id for t in data) == [701001, 701002, 701003, 701004, 701005]
+    assert [r.url.params['search'] for r in requests[3:]] == ['OST 720p', 'tt0816692', 'Interstellar 2014']
+    torrent = type('Torrent', (), {'name': 'Spider-Man.No.Way.Home.2021.1080p', 'subject': None})
+    assert SiteHelper._match_keyword('Spider-Man: No Way Home', torrent)
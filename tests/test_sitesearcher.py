@@ -0,0 +1,198 @@
+import asyncio
+import queue
+import time
+
+import httpx
+import pytest
+from httpcore import TimeoutException
+from moviebotapi.site import CateLevel1
+
+from autoptspider.site.sitehelper import SiteHelper
+from autoptspider.site.sitesearcher import MultiSiteWorkerPool, MultiSiteProcess, SiteInvokerFunction, ResultType, \
+    SiteSearcher, _SiteHelperCache, _MultiSearcherInvoker
+from tests.utils import load_html, load_mteam_config
+
+
+def test_worker_pool(mock_transport, site_config):
+    """
+    常驻工作进程池执行多站点任务，结果按任务返回，工作进程内SiteHelper在任务之间复用
+    :return:
+    """
+    content = load_html('mteam_torrents.html').encode('utf-8')
+    mock_transport(lambda request: httpx.Response(200, content=content))
+    site = {'site_config': site_config, 'cookie': 'tp=test'}
+    searchers = [{'site': site, 'query': [{'key': 'keyword', 'value': 'test'}],
+                  'cate_level1_list': [CateLevel1.Movie]}]
+    with MultiSiteWorkerPool(2) as pool:
+        for _ in range(2):
+            messages = list(pool.run(searchers, [SiteInvokerFunction.Search, SiteInvokerFunction.GetUser], 30))
+            assert [m.result_type for m in messages] == [ResultType.Result, ResultType.Result]
+            assert len(messages[0].data.data) == 5 and messages[1].data.data.username
+        q = queue.Queue()
+        with MultiSiteProcess(searchers, q, SiteInvokerFunction.List, pool):
+            assert q.get(timeout=30).result_type == ResultType.Result
+            assert q.get(timeout=30).result_type == ResultType.AllFinished
+        assert all(w.is_alive() for w in pool._workers)
+    assert not any(w.is_alive() for w in pool._workers)
+
+
+def test_site_helper_cache_release(mock_transport, site_config):
+    """
+    复用的SiteHelper在任务开始时清除上次搜索的页面；配置变化后旧的SiteHelper等任务释放后才关闭
+    :return:
+    """
+    content = load_html('mteam_torrents.html').encode('utf-8')
+    paths = []
+
+    def handler(request):
+        paths.append(str(request.url))
+        return httpx.Response(200, content=content)
+
+    mock_transport(handler)
+    site = {'site_config': site_config, 'cookie': 'tp=test'}
+    searchers = [{'site': site, 'query': [{'key': 'keyword', 'value': 'test'}],
+                  'cate_level1_list': [CateLevel1.Movie]}]
+    cache = _SiteHelperCache()
+    cache.get(site).last_search_text = 'stale'
+    q = queue.Queue()
+    asyncio.run(_MultiSearcherInvoker(searchers, q, SiteInvokerFunction.GetUser, cache).invoke())
+    assert q.get().result_type == ResultType.Result and paths == [site_config['userinfo']['path']]
+
+    async def replace_in_use():
+        helper = cache.acquire(site)
+        await helper.search(keyword='test', cate_level1_list=[CateLevel1.Movie])
+        client = helper._client
+        assert cache.get({**site, 'proxies': None}) is not helper
+        await asyncio.sleep(0)
+        assert not client.is_closed
+        await cache.release(helper)
+        assert client.is_closed
+        # 同一站点只保留一个，换Cookie后旧的SiteHelper没有任务使用时直接关闭
+        old = cache.get(site)
+        assert cache.get(dict(site)) is old and old.parse_executor.name == 'inline'
+        await old.search(keyword='test', cate_level1_list=[CateLevel1.Movie])
+        assert cache.get({**site, 'cookie': 'tp=other'}) is not old
+        await asyncio.sleep(0)
+        assert old._client is None and len(cache._helpers) == 1
+        await cache.aclose()
+
+    asyncio.run(replace_in_use())
+
+
+def test_invoker_streams_results(mock_transport):
+    """
+    每个站点完成后立即放入结果，不等待最慢的站点
+    :return:
+    """
+    content = load_html('mteam_torrents.html').encode('utf-8')
+
+    async def handler(request):
+        if 'slow' in request.headers['cookie']:
+            await asyncio.sleep(0.5)
+        return httpx.Response(200, content=content)
+
+    class TimedQueue(list):
+        def put(self, message):
+            self.append((time.monotonic(), message))
+
+    mock_transport(handler)
+    searchers = []
+    for name in ['slow', 'fast']:
+        searchers.append({'site': {'site_config': load_mteam_config(f'mteam_{name}'), 'cookie': f'tp={name}'},
+                          'query': [{'key': 'keyword', 'value': 'test'}], 'cate_level1_list': [CateLevel1.Movie]})
+    q = TimedQueue()
+    asyncio.run(_MultiSearcherInvoker(searchers, q, SiteInvokerFunction.Search).invoke())
+    assert [m.data.site_id if m.data else None for _, m in q] == ['mteam_fast', 'mteam_slow', None]
+    assert q[1][0] - q[0][0] > 0.3
+
+
+def test_invoker_deadline(mock_transport):
+    """
+    到达截止时间时已完成的站点正常返回，未完成的站点按超时返回，多关键字搜索带上截止前的结果，重试等待不超过截止时间
+    :return:
+    """
+    content = load_html('mteam_torrents.html').encode('utf-8')
+
+    async def handler(request):
+        cookie = request.headers['cookie']
+        if 'slow' in cookie:
+            await asyncio.sleep(5)
+        if 'broken' in cookie:
+            raise httpx.ConnectError('broken')
+        return httpx.Response(200, content=content)
+
+    mock_transport(handler)
+    searchers = []
+    for name, query in [('slow', ['a']), ('fast', ['a']), ('partial', ['a', 'b']), ('broken', ['a'])]:
+        searchers.append({'site': {'site_config': load_mteam_config(f'mteam_{name}'), 'cookie': f'tp={name}'},
+                          'query': [{'key': 'keyword', 'value': v} for v in query],
+                          'cate_level1_list': [CateLevel1.Movie], 'network_error_retry': name == 'broken'})
+    q = queue.Queue()
+    start = time.monotonic()
+    asyncio.run(_MultiSearcherInvoker(searchers, q, SiteInvokerFunction.Search, deadline=time.time() + 1).invoke())
+    assert time.monotonic() - start < 2
+    messages = {}
+    while not q.empty():
+        m = q.get()
+        if m.data:
+            messages[m.data.site_id] = m
+    assert messages['mteam_fast'].result_type == ResultType.Result
+    assert messages['mteam_slow'].result_type == ResultType.Timeout and not messages['mteam_slow'].data.data
+    assert messages['mteam_partial'].result_type == ResultType.Timeout and len(messages['mteam_partial'].data.data) == 5
+    assert messages['mteam_broken'].result_type == ResultType.Timeout
+
+    # 重试因到达截止时间停止时按超时返回，不报错
+    helper = SiteHelper(searchers[-1]['site']['site_config'], 'tp=broken')
+    searcher = SiteSearcher(helper, [{'key': 'keyword', 'value': 'a'}], [CateLevel1.Movie], network_error_retry=True,
+                            deadline=time.monotonic() + 0.5)
+    assert asyncio.run(searcher.search()) == {'code': 1, 'data': []}
+    with pytest.raises(TimeoutException):
+        asyncio.run(searcher.list())
+    # 站点内部的重试和限速等待也不超过截止时间
+    for retry in [False, True]:
+        searcher = SiteSearcher(helper, network_error_retry=retry, deadline=time.monotonic() + 0.5)
+        start = time.monotonic()
+        with pytest.raises(TimeoutException):
+            asyncio.run(searcher.get_userinfo(True))
+        assert time.monotonic() - start < 1.5
+    # 跳过等待不代表停止，之后成功时不算超时
+    searcher = SiteSearcher(helper, deadline=time.monotonic() + 1)
+    assert not asyncio.run(searcher._sleep(5)) and not searcher.timed_out
+
+
+def test_pipelined_pagination(mock_transport, site_config):
+    """
+    自动翻页时预先请求下一页，不足一页、达到max_results或没有结果时停止翻页
+    :return:
+    """
+    content = load_html('mteam_torrents.html')
+    pages = []
+    running = []
+    peak = []
+
+    async def handler(request):
+        page = int(request.url.params.get('page') or 0)
+        pages.append(page)
+        running.append(page)
+        peak.append(len(running))
+        await asyncio.sleep(0.05)
+        running.remove(page)
+        if page >= 4:
+            return httpx.Response(200, content=content.replace('class="torrentname"', 'class="x"').encode('utf-8'))
+        return httpx.Response(200, content=content.replace('id=70100', f'id={page + 1}0100').encode('utf-8'))
+
+    mock_transport(handler)
+
+    def search(page_size=None, max_results=None):
+        pages.clear()
+        config = {**site_config, 'search': {**site_config['search'], 'page_size': page_size}}
+        searcher = SiteSearcher(SiteHelper(config, 'tp=test'), [{'key': 'keyword', 'value': 'test'}],
+                                [CateLevel1.Movie], all_pages=True, max_results=max_results)
+        return asyncio.run(searcher.search())['data']
+
+    result = search()
+    assert len(result) == 20 and len({t.id for t in result}) == 20
+    assert max(peak) == 2 and sorted(pages)[:5] == [0, 1, 2, 3, 4] and len(pages) <= 6
+    assert len(search(page_size=6)) == 5 and sorted(pages) == [0, 1]
+    result = search(max_results=7)
+    assert [t.id for t in result][5:] == [201001, 201002] and sorted(pages) == [0, 1, 2]
@@ -0,0 +1,10 @@
+import emoji
+
+from autoptspider.utils.stringutils import StringUtils
+
+
+def test_trim_emoji_same_as_demojize():
+    # 📈后面多余的变体选择符demojize会去掉
+    for text in ['The.Movie.2023.1080p', '中文标题 1080p', '中文🎵标题', '👨‍👩‍👧 #️⃣ 1⃣ ❤️ © 🇨🇳', '📈\ufe0f 上涨',
+                 '标题\ufe0f', '', None]:
+        assert StringUtils.trim_emoji(text) == (emoji.demojize(text) if text else text)
@@ -0,0 +1,51 @@
+import os
+from typing import Optional
+
+import yaml
+
+from autoptspider.site.sitehelper import SiteHelper
+
+TMPL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
+HTML_PATH = os.path.join(os.path.dirname(__file__), 'html')
+
+
+def load_yaml_config(filepath: str):
+    """
+    加载一个yaml格式的文件
+    :param filepath:
+    :return:
+    """
+    if not filepath or not os.path.exists(filepath):
+        raise FileNotFoundError(f'找不到配置文件: {filepath}')
+    with open(filepath, 'r', encoding='utf-8') as file:
+        user_config = yaml.safe_load(file)
+    return user_config
+
+
+def load_html(filename: str):
+    with open(os.path.join(HTML_PATH, filename), 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def load_mteam_config(site_id: Optional[str] = None, rate: float = 100):
+    """
+    加载mteam适配文件，放宽限速避免测试等待
+    :param site_id: 指定时替换站点编号，限速器按站点编号共用
+    :param rate: 请求和下载每秒的速率
+    :return:
+    """
+    site_config = load_yaml_config(os.path.join(TMPL_PATH, 'mteam.yml'))
+    if site_id:
+        site_config['id'] = site_id
+    site_config['rate_limit'] = {'request': {'rate': rate, 'max_rate': rate},
+                                 'download': {'rate': rate, 'max_rate': rate}}
+    return site_config
+
+
+def get_mteam_helper():
+    return SiteHelper(load_yaml_config(os.path.join(TMPL_PATH, 'mteam.yml')), 'tp=test')
+
+
+def without_now(item: dict):
+    # free_deadline由当前时间推算，不参与对比
+    return {k: v for k, v in item.items() if k != 'free_deadline'}